@@ -0,0 +1,23 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+from main import app
+
+#gunicorn_config.py sets this from WEB_THREADS under the asgi profile
+ASGI_THREADS = int(os.environ.get('ASGI_THREADS', 8))
+
+#asgiref runs every WSGI call on one shared thread by default, which would serialize the whole worker.
+#Run each request on our own pool instead, so a request waiting on OpenWeatherMap holds one pool
+#thread and the worker keeps accepting connections
+_executor = ThreadPoolExecutor(max_workers=ASGI_THREADS, thread_name_prefix='asgi')
+
+class PooledWsgiToAsgiInstance(WsgiToAsgiInstance):
+    run_wsgi_app = sync_to_async(WsgiToAsgiInstance.__dict__['run_wsgi_app'].func, thread_sensitive=False, executor=_executor)
+
+class PooledWsgiToAsgi(WsgiToAsgi):
+    async def __call__(self, scope, receive, send):
+        await PooledWsgiToAsgiInstance(self.wsgi_application)(scope, receive, send)
+
+#For ASGI servers, WEB_PROFILE=asgi runs this under uvicorn workers
+asgi_app = PooledWsgiToAsgi(app)
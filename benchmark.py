@@ -0,0 +1,155 @@
+import argparse
+import logging
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+
+#Offline load test: python benchmark.py --users 20 --duration 30 --latency 0.2
+#Starts the app on a temp database with a fake OpenWeatherMap, or drives an already running server with --target
+
+DEFAULT_MIX = 'home=3,add=1,check=4,dashboard=2,login=1'
+CITIES = ['London', 'Paris', 'Tokyo', 'New York', 'Berlin', 'Madrid', 'Rome', 'Sydney', 'Toronto', 'Chicago',
+          'Seoul', 'Mumbai', 'Cairo', 'Lima', 'Oslo', 'Dublin', 'Vienna', 'Prague', 'Lisbon', 'Athens']
+
+def parse_mix(mix):
+    weights = {}
+    for part in mix.split(','):
+        name, weight = part.split('=')
+        weights[name.strip()] = float(weight)
+    return weights
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+class VirtualUser:
+    def __init__(self, base_url, n, cities):
+        import requests
+        self.base_url = base_url.rstrip('/')
+        self.session = requests.Session()
+        self.email = 'bench%d-%d@example.com' % (n, int(time.time() * 1000))
+        self.password = 'benchmark-password'
+        #Popular cities come up far more often, like real users
+        self.cities = cities
+        self.city_ids = []
+
+    def url(self, path):
+        return self.base_url + path
+
+    def sign_up(self):
+        return self.session.post(self.url('/sign-up'), data={'email': self.email, 'firstName': 'Bench',
+                                                             'password1': self.password, 'password2': self.password})
+
+    def home(self):
+        response = self.session.get(self.url('/'))
+        self.city_ids = [int(i) for i in re.findall(r'checkWeather\(\s*(\d+)\s*\)', response.text)]
+        return response
+
+    def add(self):
+        city = random.choices(self.cities, weights=[1.0 / (i + 1) for i in range(len(self.cities))])[0]
+        return self.session.post(self.url('/'), data={'city': city})
+
+    def check(self):
+        if not self.city_ids:
+            return self.add()
+        return self.session.post(self.url('/weather'), data='{"cityId": %d}' % random.choice(self.city_ids))
+
+    def dashboard(self):
+        return self.session.get(self.url('/dashboard'))
+
+    def login(self):
+        self.session.get(self.url('/logout'))
+        return self.session.post(self.url('/login'), data={'email': self.email, 'password': self.password})
+
+def run_user(user, mix, deadline, results, lock):
+    actions = list(mix)
+    weights = [mix[action] for action in actions]
+    user.sign_up()
+    user.add()
+    user.home()
+    while time.monotonic() < deadline:
+        action = random.choices(actions, weights)[0]
+        started = time.perf_counter()
+        try:
+            ok = getattr(user, action)().status_code < 500
+        except Exception:
+            ok = False
+        elapsed = time.perf_counter() - started
+        with lock:
+            results.setdefault(action, []).append((elapsed, ok))
+        if action == 'add':
+            user.home()
+
+def report(results, duration):
+    print('%-10s %8s %8s %9s %9s %9s' % ('action', 'requests', 'errors', 'p50 ms', 'p95 ms', 'p99 ms'))
+    everything = []
+    for action in sorted(results):
+        samples = results[action]
+        latencies = [elapsed * 1000 for elapsed, _ in samples]
+        errors = sum(1 for _, ok in samples if not ok)
+        everything.extend(latencies)
+        print('%-10s %8d %8d %9.1f %9.1f %9.1f' % (action, len(samples), errors, percentile(latencies, 50),
+                                                 percentile(latencies, 95), percentile(latencies, 99)))
+    print('%-10s %8d %8s %9.1f %9.1f %9.1f' % ('all', len(everything), '', percentile(everything, 50),
+                                             percentile(everything, 95), percentile(everything, 99)))
+    print('throughput: %.1f requests/s' % (len(everything) / duration))
+
+#The app reads its settings when website is first imported, so this has to run before that
+def use_temp_database():
+    workdir = tempfile.mkdtemp(prefix='weather-bench-')
+    os.environ.setdefault('DATABASE_PATH', os.path.join(workdir, 'database.db'))
+    os.environ.setdefault('WEATHER_SHARED_CACHE', os.path.join(workdir, 'weather_cache.db'))
+    os.environ.setdefault('MIGRATION_LOCK', os.path.join(workdir, 'migrate.lock'))
+
+def start_local_app(upstream_url):
+    from werkzeug.serving import make_server
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    from website import create_app
+    from website.api import weatherAPI
+    weatherAPI.BASE_URL = upstream_url
+    server = make_server('127.0.0.1', 0, create_app(), threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return 'http://127.0.0.1:%d' % server.server_port
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the weather site against a fake OpenWeatherMap')
+    parser.add_argument('--users', type=int, default=10, help='concurrent virtual users')
+    parser.add_argument('--duration', type=float, default=20, help='seconds of traffic')
+    parser.add_argument('--latency', type=float, default=0.1, help='fake upstream latency in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of upstream calls that return 503')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='action weights, default ' + DEFAULT_MIX)
+    parser.add_argument('--cities', type=int, default=len(CITIES), help='how many distinct cities users pick from')
+    parser.add_argument('--target', help='base URL of a running server (start it with WEATHER_BASE_URL pointing at the fake upstream)')
+    parser.add_argument('--upstream-port', type=int, default=0, help='port for the fake upstream, useful with --target')
+    args = parser.parse_args()
+
+    if not args.target:
+        use_temp_database()
+    from website.api.fake_upstream import FakeUpstream
+    upstream = FakeUpstream(latency=args.latency, error_rate=args.error_rate, port=args.upstream_port).start()
+    print('fake upstream: %s (latency %.3fs, error rate %.2f)' % (upstream.base_url, args.latency, args.error_rate))
+    base_url = args.target or start_local_app(upstream.base_url)
+    print('target: %s, %d users for %.0fs' % (base_url, args.users, args.duration))
+
+    mix = parse_mix(args.mix)
+    cities = CITIES[:args.cities]
+    results = {}
+    lock = threading.Lock()
+    deadline = time.monotonic() + args.duration
+    threads = [threading.Thread(target=run_user, args=(VirtualUser(base_url, n, cities), mix, deadline, results, lock))
+               for n in range(args.users)]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    report(results, time.monotonic() - started)
+    print('upstream calls: %d' % upstream.calls)
+
+if __name__ == '__main__':
+    main()
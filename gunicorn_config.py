@@ -1,3 +1,111 @@
-workers = 4
-bind = "0.0.0.0:8000"
+import math
+import multiprocessing
+import os
 
+#Every setting below can be overridden with the environment variable next to it
+
+def env_int(name, default):
+    return int(os.environ.get(name, default))
+
+def env_float(name, default):
+    return float(os.environ.get(name, default))
+
+cpus = multiprocessing.cpu_count()
+
+#How a worker serves requests, picked with WEB_PROFILE:
+#  sync    - one request per worker at a time, a slow OpenWeatherMap call blocks the whole worker
+#  gthread - several requests per worker, a thread waiting on upstream doesn't block the others
+#  asgi    - uvicorn workers serving asgi:asgi_app, requests run on a pool of ASGI_THREADS threads
+profile = os.environ.get('WEB_PROFILE', 'gthread')
+
+#Share of a request's time spent waiting on OpenWeatherMap or the database rather than using CPU.
+#At 0.9 a thread only needs the CPU a tenth of the time, so ten threads keep one core busy
+io_ratio = min(max(env_float('WEB_IO_RATIO', 0.9), 0.0), 0.97)
+
+if profile == 'sync':
+    worker_class = 'sync'
+    threads = 1
+    #Sync workers are the only concurrency, so lean on the classic 2 x cores + 1
+    workers = env_int('WEB_WORKERS', cpus * 2 + 1)
+elif profile in ('gthread', 'asgi'):
+    threads = env_int('WEB_THREADS', min(32, max(2, round(1 / (1 - io_ratio)))))
+    #Threads cover the I/O waits, one worker per core covers the CPU work and the GIL
+    workers = env_int('WEB_WORKERS', cpus + 1)
+    if profile == 'gthread':
+        worker_class = 'gthread'
+    else:
+        worker_class = 'uvicorn.workers.UvicornWorker'
+        os.environ.setdefault('ASGI_THREADS', str(threads))
+else:
+    raise ValueError('WEB_PROFILE must be sync, gthread or asgi, not %r' % profile)
+
+wsgi_app = 'asgi:asgi_app' if profile == 'asgi' else 'main:app'
+bind = os.environ.get('WEB_BIND', "0.0.0.0:8000")
+backlog = env_int('WEB_BACKLOG', 2048)
+#Long enough to reuse a connection across a page load and its follow-up fetch() calls
+keepalive = env_int('WEB_KEEPALIVE', 5)
+
+#Recycle workers now and then so slow memory growth can't pile up, with jitter so they don't all restart together
+max_requests = env_int('WEB_MAX_REQUESTS', 2000)
+max_requests_jitter = env_int('WEB_MAX_REQUESTS_JITTER', max_requests // 10)
+
+#Load the app once in the master so workers share its imported code and warmed data copy-on-write
+preload_app = os.environ.get('WEB_PRELOAD', '1') == '1'
+
+#A worker is only stuck if it has been quiet longer than the slowest upstream call can take:
+#every attempt timing out on connect and read, plus the retry backoff, plus some slack
+_connect = env_float('WEATHER_CONNECT_TIMEOUT', 3.05)
+_read = env_float('WEATHER_READ_TIMEOUT', 5)
+_retries = env_int('WEATHER_RETRIES', 2)
+_backoff = env_float('WEATHER_BACKOFF', 0.3)
+_upstream_worst = (_connect + _read) * (_retries + 1) + sum(_backoff * 2 ** i for i in range(_retries))
+timeout = env_int('WEB_TIMEOUT', math.ceil(_upstream_worst) + 10)
+graceful_timeout = env_int('WEB_GRACEFUL_TIMEOUT', timeout)
+
+#Workers write metric samples here and /metrics sums them. It has to exist before the app imports
+#prometheus_client, which with preload_app happens before any server hook runs
+DEFAULT_METRICS_DIR = '/tmp/weather-metrics'
+_own_metrics_dir = 'PROMETHEUS_MULTIPROC_DIR' not in os.environ
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', DEFAULT_METRICS_DIR)
+os.makedirs(os.environ['PROMETHEUS_MULTIPROC_DIR'], exist_ok=True)
+
+#Samples left over from a previous run would be summed into this one, so start the default directory empty.
+#Only once at startup, a reload re-reads this file while workers are still writing there,
+#and a directory the operator chose is left alone
+def on_starting(server):
+    if _own_metrics_dir:
+        for name in os.listdir(DEFAULT_METRICS_DIR):
+            if name.endswith('.db'):
+                os.remove(os.path.join(DEFAULT_METRICS_DIR, name))
+
+#With the app preloaded, load the city list in the master too so every worker shares one copy
+def when_ready(server):
+    if preload_app:
+        from website.api.gazetteer import get_gazetteer
+        get_gazetteer()
+    server.log.info('profile=%s workers=%d threads=%d timeout=%ds preload=%s', profile, workers, threads, timeout, preload_app)
+
+#Connections opened in the master (migrations, the shared cache) can't be used safely from a forked child
+def post_fork(server, worker):
+    if preload_app:
+        from website import db
+        from website.api.client import client
+        from website.api.shared_cache import shared_cache
+        from main import app
+        db.get_engine(app).dispose()
+        shared_cache.reset()
+        client.close()
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
+
+#Pre-warm the weather cache for tracked cities from one worker, set WEATHER_PREWARM=0 to run it separately.
+#Each worker also publishes its own breaker state, the preloaded master never does
+def post_worker_init(worker):
+    from website import metrics
+    metrics.init_worker()
+    if os.environ.get('WEATHER_PREWARM', '1') == '1':
+        from website.prewarm import start
+        #Under the asgi profile worker.wsgi is the adapter around the Flask app
+        start(getattr(worker.wsgi, 'wsgi_application', worker.wsgi))
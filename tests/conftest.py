@@ -0,0 +1,69 @@
+import os
+import tempfile
+import pytest
+
+#The website package reads its settings at import, so point everything at throwaway files first.
+#Never the committed database.db, and never the real OpenWeatherMap
+_workdir = tempfile.mkdtemp(prefix='weather-tests-')
+os.environ['DATABASE_PATH'] = os.path.join(_workdir, 'database.db')
+os.environ['WEATHER_SHARED_CACHE'] = os.path.join(_workdir, 'weather_cache.db')
+os.environ['MIGRATION_LOCK'] = os.path.join(_workdir, 'migrate.lock')
+os.environ['WEATHER_PREWARM_LOCK'] = os.path.join(_workdir, 'prewarm.lock')
+os.environ['WEATHER_CITY_LIST'] = os.path.join(_workdir, 'no-city-list.json')
+os.environ['WEATHER_BASE_URL'] = 'http://127.0.0.1:9/data/2.5/weather?'
+os.environ['WEATHER_RETRIES'] = '0'
+os.environ.pop('DATABASE_URL', None)
+os.environ.pop('PROMETHEUS_MULTIPROC_DIR', None)
+
+from website import config, create_app, db
+from website.api import weatherAPI
+from website.api.client import client
+from website.api.fake_upstream import FakeUpstream
+from .helpers import reset_weather_state
+
+@pytest.fixture(scope='session')
+def upstream_server():
+    server = FakeUpstream().start()
+    yield server
+    server.stop()
+
+#Offline OpenWeatherMap, reset for every test. Set .latency or .error_rate to simulate a slow or failing upstream
+@pytest.fixture
+def fake_upstream(upstream_server, monkeypatch):
+    upstream_server.latency = 0.0
+    upstream_server.error_rate = 0.0
+    upstream_server.calls = 0
+    monkeypatch.setattr(weatherAPI, 'BASE_URL', upstream_server.base_url)
+    return upstream_server
+
+#Every test starts with cold caches and a closed breaker
+@pytest.fixture(autouse=True)
+def clean_weather_state():
+    reset_weather_state()
+    yield
+
+#A fresh app on its own database. database_url is any SQLAlchemy URL, SQLite in tmp_path by default
+@pytest.fixture
+def make_app(tmp_path, monkeypatch, fake_upstream):
+    apps = []
+    listeners = list(weatherAPI.upstream_listeners)
+    observers = list(client.observers)
+    breaker_observers = list(client.breaker.observers)
+
+    def make(database_url=None):
+        monkeypatch.setattr(config, 'DATABASE_URL', database_url or 'sqlite:///%s' % (tmp_path / 'database.db'))
+        app = create_app()
+        app.config['TESTING'] = True
+        apps.append(app)
+        return app
+
+    yield make
+    weatherAPI.upstream_listeners[:] = listeners
+    client.observers[:] = observers
+    client.breaker.observers[:] = breaker_observers
+    for app in apps:
+        db.get_engine(app).dispose()
+
+@pytest.fixture
+def app(make_app):
+    return make_app()
@@ -0,0 +1,37 @@
+import json
+import sqlite3
+from website.api import weatherAPI
+from website.api.breaker import CLOSED
+from website.api.client import client as weather_client
+from website.api.shared_cache import shared_cache
+from website.models import City, User
+
+#Module-level caches and the breaker outlive a test, this makes them cold and closed again
+def reset_weather_state():
+    weatherAPI.weather_cache.clear()
+    weatherAPI.validation_cache.clear()
+    shared_cache._ids.clear()
+    with sqlite3.connect(shared_cache.path) as conn:
+        conn.execute('DELETE FROM weather_cache')
+        conn.execute('DELETE FROM city_id')
+    breaker = weather_client.breaker
+    breaker.failures = 0
+    breaker._probe_at = None
+    breaker._set_state(CLOSED)
+
+def sign_up(client, email='tester@example.com', first_name='Tester', password='passw0rd!'):
+    response = client.post('/sign-up', data={'email': email, 'firstName': first_name,
+                                             'password1': password, 'password2': password})
+    assert response.status_code in (200, 302)
+    return response
+
+def add_city(client, name):
+    return client.post('/', data={'city': name})
+
+def city_id(app, email, name):
+    with app.app_context():
+        user = User.query.filter_by(email=email).one()
+        return City.query.filter_by(user_id=user.id, name=name).one().id
+
+def check_weather(client, city_id):
+    return client.post('/weather', data=json.dumps({'cityId': city_id}))
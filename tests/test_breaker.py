@@ -0,0 +1,125 @@
+import sqlite3
+import time
+import pytest
+from website.api import weatherAPI
+from website.api.breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+from website.api.cache import MAX_STALE
+from website.api.client import client
+from website.api.shared_cache import shared_cache
+from .helpers import add_city, check_weather, city_id, sign_up
+
+def make_breaker(**options):
+    options = dict({'failure_threshold': 3, 'slow_call': 1.0, 'reset_timeout': 0.05}, **options)
+    return CircuitBreaker(**options)
+
+def test_opens_after_consecutive_failures_only():
+    breaker = make_breaker()
+    for status in (500, 503, 200, None, 429):
+        breaker.record(0.1, status)
+    assert breaker.state == CLOSED
+    breaker.record(0.1, 502)
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    assert breaker.stats() == {'state': OPEN, 'failures': 3, 'rejected': 1, 'trips': 1}
+
+def test_slow_successes_count_as_failures_and_404_does_not():
+    breaker = make_breaker()
+    for _ in range(5):
+        breaker.record(0.1, 404)
+    assert breaker.state == CLOSED
+    for _ in range(3):
+        breaker.record(1.5, 200)
+    assert breaker.state == OPEN
+
+def test_half_open_lets_one_probe_through_and_closes_on_success():
+    states = []
+    breaker = make_breaker(failure_threshold=1)
+    breaker.observers.append(states.append)
+    breaker.record(0.1, None)
+    time.sleep(0.06)
+    breaker.before_call()
+    assert breaker.state == HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record(0.1, 200)
+    assert breaker.state == CLOSED
+    assert states == [OPEN, HALF_OPEN, CLOSED]
+
+def test_failed_probe_reopens():
+    breaker = make_breaker(failure_threshold=1)
+    breaker.record(0.1, None)
+    time.sleep(0.06)
+    breaker.before_call()
+    breaker.record(0.1, 503)
+    assert breaker.state == OPEN
+    assert breaker.trips == 2
+
+def test_lost_probe_does_not_keep_it_half_open():
+    breaker = make_breaker(failure_threshold=1)
+    breaker.record(0.1, None)
+    time.sleep(0.06)
+    breaker.before_call()
+    time.sleep(0.06)
+    breaker.before_call()
+    assert breaker.state == HALF_OPEN
+
+def trip():
+    client.breaker._set_state(OPEN)
+    client.breaker._opened_at = time.monotonic()
+
+def test_open_breaker_fails_fast_without_calling_upstream(fake_upstream):
+    fake_upstream.latency = 0.5
+    trip()
+    started = time.monotonic()
+    with pytest.raises(CircuitOpenError):
+        weatherAPI.fetch_json('Lima')
+    assert time.monotonic() - started < 0.1
+    assert fake_upstream.calls == 0
+
+def test_failing_upstream_trips_the_client_breaker(fake_upstream):
+    fake_upstream.error_rate = 1.0
+    for n in range(client.breaker.failure_threshold):
+        with pytest.raises(weatherAPI.UPSTREAM_ERRORS):
+            weatherAPI.fetch_json('City %d' % n)
+    assert client.breaker.state == OPEN
+
+def test_pages_degrade_while_upstream_is_down(app, fake_upstream):
+    browser = app.test_client()
+    sign_up(browser)
+    add_city(browser, 'Lima')
+    add_city(browser, 'Quito')
+    lima = city_id(app, 'tester@example.com', 'Lima')
+    quito = city_id(app, 'tester@example.com', 'Quito')
+    weatherAPI.weather_cache.clear()
+    #Only a copy of Lima too old for normal serving is left, and none of Quito
+    with sqlite3.connect(shared_cache.path) as conn:
+        conn.execute("UPDATE weather_cache SET fetched_at = ? WHERE city = 'lima'", (time.time() - MAX_STALE - 60,))
+        conn.execute("DELETE FROM weather_cache WHERE city = 'quito'")
+    trip()
+    assert check_weather(browser, lima).status_code == 200
+    page = browser.get('/weather').data
+    assert b'Lima' in page and b'OpenWeatherMap is not responding' in page
+    assert check_weather(browser, quito).status_code == 503
+    assert b'unavailable right now' in browser.get('/weather').data
+    page = browser.get('/dashboard').data
+    assert b'Lima' in page and b'Last updated %d minutes ago' % ((MAX_STALE + 60) // 60) in page
+    assert b'OpenWeatherMap is not responding' in page
+    assert b'right now' in add_city(browser, 'Atlantis').data
+    assert fake_upstream.calls == 2
+
+def test_outage_is_not_reported_as_an_unknown_city(app, fake_upstream):
+    browser = app.test_client()
+    sign_up(browser)
+    fake_upstream.error_rate = 1.0
+    page = add_city(browser, 'Atlantis').data
+    assert b'right now' in page
+    assert b'does not exist' not in page
+
+def test_breaker_state_is_exported(app):
+    from website import metrics
+    metrics.init_worker()
+    trip()
+    page = app.test_client().get('/metrics').data
+    assert b'weather_upstream_breaker_state{state="open"} 1.0' in page
+    assert b'weather_upstream_breaker_state{state="closed"} 0.0' in page
@@ -0,0 +1,52 @@
+import threading
+from website.api.cache import TTLCache, normalize_city
+
+def test_normalize_city_shares_one_key_per_city():
+    assert normalize_city('  New   York , US') == normalize_city('new york,us') == 'new york,us'
+    assert normalize_city('London, UK') == 'london,gb'
+    assert normalize_city(' , ') == ''
+
+def test_values_expire_after_ttl():
+    cache = TTLCache(maxsize=10, ttl=60)
+    cache.put('lima', 1)
+    cache.put('quito', 2, age=61)
+    assert cache.get('lima') == 1
+    assert cache.get('quito') is None
+    assert cache.get('bogota') is None
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['expirations']) == (1, 2, 1)
+    assert len(cache) == 1
+
+def test_least_recently_used_entry_is_evicted():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    cache.get('a')
+    cache.put('c', 3)
+    assert cache.get('b') is None
+    assert (cache.get('a'), cache.get('c')) == (1, 3)
+    assert cache.stats()['evictions'] == 1
+
+def test_invalidate_and_clear():
+    cache = TTLCache(maxsize=10, ttl=60)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    cache.invalidate('a')
+    assert cache.get('a') is None
+    cache.clear()
+    assert len(cache) == 0
+
+def test_concurrent_use_keeps_the_bound_and_the_counts():
+    cache = TTLCache(maxsize=50, ttl=60)
+    def work(n):
+        for i in range(500):
+            cache.put((n, i % 80), i)
+            cache.get((n, (i * 7) % 80))
+    threads = [threading.Thread(target=work, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stats = cache.stats()
+    assert len(cache) == 50
+    assert stats['hits'] + stats['misses'] == 8 * 500
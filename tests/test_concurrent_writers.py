@@ -0,0 +1,47 @@
+import multiprocessing
+from sqlalchemy import create_engine, text
+from website import config
+
+WRITERS = 4
+ROWS = 25
+
+#Runs in its own process, like one gunicorn worker: its own app, engine and connection pool
+def write_rows(database_url, writer, start):
+    config.DATABASE_URL = database_url
+    from website import create_app, db
+    from website.models import CityWeather
+    app = create_app()
+    start.wait(30)
+    with app.app_context():
+        for row in range(ROWS):
+            db.session.add(CityWeather(city_key='writer%d-%d' % (writer, row), name='Writer'))
+            #Every writer also updates one shared row, so they contend for the same page
+            db.session.execute(text('UPDATE city_weather SET temp_k = COALESCE(temp_k, 0) + 1 WHERE city_key = :key'),
+                               {'key': 'shared'})
+            db.session.commit()
+
+def test_concurrent_writer_processes_do_not_hit_database_is_locked(make_app, tmp_path):
+    from website import db
+    from website.models import CityWeather
+    database_url = 'sqlite:///%s' % (tmp_path / 'database.db')
+    app = make_app(database_url)
+    with app.app_context():
+        db.session.add(CityWeather(city_key='shared', name='Shared'))
+        db.session.commit()
+
+    context = multiprocessing.get_context('spawn')
+    start = context.Event()
+    writers = [context.Process(target=write_rows, args=(database_url, writer, start)) for writer in range(WRITERS)]
+    for process in writers:
+        process.start()
+    start.set()
+    for process in writers:
+        process.join(120)
+    assert [process.exitcode for process in writers] == [0] * WRITERS
+
+    engine = create_engine(database_url)
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT COUNT(*) FROM city_weather WHERE city_key LIKE 'writer%'")).scalar() == WRITERS * ROWS
+        assert conn.execute(text("SELECT temp_k FROM city_weather WHERE city_key = 'shared'")).scalar() == WRITERS * ROWS
+        assert conn.execute(text('PRAGMA journal_mode')).scalar() == 'wal'
+    engine.dispose()
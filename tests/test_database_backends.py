@@ -0,0 +1,70 @@
+import os
+import threading
+import pytest
+from sqlalchemy import MetaData, create_engine, text
+from website import db, migrations
+from website.models import City, CityWeather
+from .helpers import add_city, check_weather, city_id, reset_weather_state, sign_up
+
+#A scratch PostgreSQL database, every table in it is dropped after each test
+TEST_DATABASE_URL = os.environ.get('TEST_DATABASE_URL', '')
+
+@pytest.fixture(params=['sqlite', pytest.param('postgresql', marks=pytest.mark.skipif(
+    not TEST_DATABASE_URL, reason='set TEST_DATABASE_URL to run against PostgreSQL'))])
+def backend_app(request, make_app):
+    if request.param == 'sqlite':
+        yield make_app()
+        return
+    pytest.importorskip('psycopg2')
+    app = make_app(TEST_DATABASE_URL)
+    yield app
+    engine = create_engine(TEST_DATABASE_URL)
+    metadata = MetaData()
+    metadata.reflect(engine)
+    metadata.drop_all(engine)
+    engine.dispose()
+
+def test_new_database_is_created_at_the_latest_version(backend_app):
+    with db.get_engine(backend_app).connect() as conn:
+        versions = [row[0] for row in conn.execute(text('SELECT version FROM schema_version ORDER BY version'))]
+    assert versions == [version for version, _, _ in migrations.MIGRATIONS]
+    assert migrations.upgrade(backend_app, db) == []
+
+def test_pages_work_on_every_backend(backend_app):
+    client = backend_app.test_client()
+    sign_up(client)
+    assert add_city(client, 'Lima').status_code == 200
+    assert add_city(client, 'Nowhere Land').status_code == 200
+    lima = city_id(backend_app, 'tester@example.com', 'Lima')
+    assert check_weather(client, lima).status_code == 200
+    assert b'Lima' in client.get('/weather').data
+    assert b'Lima' in client.get('/dashboard').data
+    assert client.get('/history/%d' % lima).status_code == 200
+    assert client.post('/delete-note', data='{"cityId": %d}' % lima).status_code == 200
+    with backend_app.app_context():
+        assert City.query.count() == 0
+        assert CityWeather.query.filter_by(city_key='lima').count() == 1
+
+#Both users' first check of a city race to create its shared CityWeather row
+def test_first_checks_of_a_city_share_one_row(backend_app, fake_upstream):
+    fake_upstream.latency = 0.2
+    clients = []
+    for n in range(2):
+        client = backend_app.test_client()
+        email = 'racer%d@example.com' % n
+        sign_up(client, email)
+        add_city(client, 'Berlin')
+        clients.append((client, city_id(backend_app, email, 'Berlin')))
+    #Nothing cached, so both requests wait on the same upstream call and reach the insert together
+    reset_weather_state()
+    #Let a failed request come back as a 500 instead of raising inside its thread
+    backend_app.config['TESTING'] = False
+    statuses = []
+    threads = [threading.Thread(target=lambda c=c, i=i: statuses.append(check_weather(c, i).status_code)) for c, i in clients]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert statuses == [200, 200]
+    with backend_app.app_context():
+        assert CityWeather.query.filter_by(city_key='berlin').count() == 1
@@ -0,0 +1,64 @@
+import time
+from website.api import weatherAPI
+from website.api.breaker import OPEN
+from website.api.client import client
+from website.prewarm import RateLimiter
+
+CITIES = ['City %d' % i for i in range(45)]
+
+def test_known_cities_refresh_twenty_per_call(fake_upstream):
+    for city in CITIES:
+        weatherAPI.fetch_json(city)
+    fake_upstream.calls = 0
+    snapshots = weatherAPI.fetch_group(CITIES)
+    assert fake_upstream.calls == 3
+    assert [snapshot.name for snapshot in snapshots] == CITIES
+
+def test_unknown_cities_fall_back_and_are_remembered(fake_upstream):
+    snapshots = weatherAPI.fetch_group(CITIES[:5])
+    assert all(snapshots)
+    assert fake_upstream.calls == 5
+    weatherAPI.fetch_group(CITIES[:5])
+    assert fake_upstream.calls == 6
+
+def test_throttle_runs_before_every_upstream_call(fake_upstream):
+    throttled = []
+    weatherAPI.fetch_group(CITIES[:3], lambda: throttled.append(fake_upstream.calls))
+    assert throttled == [0, 1, 2]
+
+def test_failed_group_call_falls_back_per_city(fake_upstream, monkeypatch):
+    weatherAPI.fetch_group(CITIES[:4])
+    group_url = weatherAPI.group_url
+    monkeypatch.setattr(weatherAPI, 'group_url', lambda ids: group_url(ids).replace('/group?', '/missing?'))
+    fake_upstream.calls = 0
+    assert all(weatherAPI.fetch_group(CITIES[:4]))
+    assert fake_upstream.calls == 5
+
+def test_open_breaker_skips_the_rest_of_the_pass(fake_upstream):
+    client.breaker._set_state(OPEN)
+    client.breaker._opened_at = time.monotonic()
+    throttled = []
+    assert weatherAPI.fetch_group(CITIES[:10], lambda: throttled.append(1)) == [None] * 10
+    assert fake_upstream.calls == 0
+    assert len(throttled) == 1
+
+def test_rate_limiter_allows_a_burst_then_spaces_calls():
+    limiter = RateLimiter(rate=600, burst=2)
+    started = time.monotonic()
+    for _ in range(5):
+        limiter.wait()
+    #Two free calls, then three more 0.1 s apart
+    assert 0.25 <= time.monotonic() - started < 1
+
+def test_prewarm_refreshes_each_tracked_city_once(app, fake_upstream):
+    from website import db, prewarm
+    from website.models import City, User
+    with app.app_context():
+        for n, names in enumerate((['Lima', 'Quito'], ['lima ', 'Bogota'])):
+            user = User(email='prewarm%d@example.com' % n, first_name='Pre', password='x')
+            db.session.add(user)
+            db.session.flush()
+            db.session.add_all([City(name=name, user_id=user.id) for name in names])
+        db.session.commit()
+    assert prewarm.prewarm_once(app, rate=6000, batch_size=10) == 3
+    assert fake_upstream.calls == 3
@@ -0,0 +1,48 @@
+import pytest
+from sqlalchemy import inspect, text
+from website import db, migrations
+
+CITY_WEATHER_SQL = ('CREATE TABLE city_weather ('
+                    'id INTEGER NOT NULL, city_key VARCHAR(200) NOT NULL, name VARCHAR(200), temp_k INTEGER, '
+                    'temp_f NUMERIC(10, 2), temp_c NUMERIC(10, 2), temp_min NUMERIC(10, 2), '
+                    'temp_max NUMERIC(10, 2), description VARCHAR(150), '
+                    'wind_speed NUMERIC(10, 2), wind_dir INTEGER, updated_at INTEGER, feels_like INTEGER, '
+                    'PRIMARY KEY (id))')
+
+@pytest.fixture
+def engine(app):
+    engine = db.get_engine(app)
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO city_weather (id, city_key, name) VALUES (7, 'lima', 'Lima')"))
+        conn.execute(text('INSERT INTO "user" (id, email, first_name, password, weather_id) '
+                          "VALUES (1, 'a@example.com', 'A', 'x', 7)"))
+    return engine
+
+#Batch mode exists to rebuild tables like city_weather, which user.weather_id points at
+def test_rebuilding_a_referenced_table_keeps_the_reference(engine):
+    with migrations.ddl_transaction(engine) as conn:
+        migrations.batch_rebuild_table(conn, 'city_weather', CITY_WEATHER_SQL,
+                                       ['CREATE UNIQUE INDEX ix_city_weather_city_key ON city_weather (city_key)'],
+                                       columns=['id', 'city_key', 'name', 'temp_k', 'temp_f', 'temp_c', 'temp_min',
+                                                'temp_max', 'description', 'wind_speed', 'wind_dir', 'updated_at'])
+    with engine.connect() as conn:
+        assert 'feels_like' in [column['name'] for column in inspect(conn).get_columns('city_weather')]
+        assert conn.execute(text('SELECT city_weather.name FROM "user" JOIN city_weather ON city_weather.id = "user".weather_id')).scalar() == 'Lima'
+        assert conn.execute(text('PRAGMA foreign_keys')).scalar() == 1
+
+def test_broken_foreign_keys_roll_the_migration_back(engine):
+    with pytest.raises(RuntimeError, match='broken foreign keys'):
+        with migrations.ddl_transaction(engine) as conn:
+            conn.execute(text('DELETE FROM city_weather WHERE id = 7'))
+    with engine.connect() as conn:
+        assert conn.execute(text('SELECT COUNT(*) FROM city_weather')).scalar() == 1
+        assert conn.execute(text('PRAGMA foreign_keys')).scalar() == 1
+
+#DDL must roll back with the rest of a failed migration, or every later start trips over it
+def test_failed_migration_leaves_no_schema_changes(engine):
+    with pytest.raises(ValueError):
+        with migrations.ddl_transaction(engine) as conn:
+            migrations.add_column(conn, 'city_weather', 'feels_like', 'INTEGER')
+            raise ValueError('migration failed halfway')
+    with engine.connect() as conn:
+        assert 'feels_like' not in [column['name'] for column in inspect(conn).get_columns('city_weather')]
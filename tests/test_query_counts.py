@@ -0,0 +1,47 @@
+import pytest
+from website import db
+from website.querycount import assert_max_queries, count_queries
+from .helpers import add_city, check_weather, city_id, sign_up
+
+#Each page runs a fixed number of statements however many cities the user tracks
+@pytest.fixture(params=[1, 20], ids=['1-city', '20-cities'])
+def tracked(request, app):
+    client = app.test_client()
+    sign_up(client)
+    for n in range(request.param):
+        add_city(client, 'Town %d' % n)
+    return client, city_id(app, 'tester@example.com', 'Town 0')
+
+def test_home(app, tracked):
+    client, _ = tracked
+    #The user with their weather row, then their cities
+    with assert_max_queries(db.get_engine(app), 2):
+        assert client.get('/').status_code == 200
+
+def test_weather(app, tracked):
+    client, town = tracked
+    engine = db.get_engine(app)
+    #First check of a city also creates its shared weather row and points the user at it
+    with assert_max_queries(engine, 7):
+        assert check_weather(client, town).status_code == 200
+    with assert_max_queries(engine, 4):
+        assert check_weather(client, town).status_code == 200
+    with assert_max_queries(engine, 1):
+        assert client.get('/weather').status_code == 200
+
+def test_dashboard(app, tracked):
+    client, _ = tracked
+    with assert_max_queries(db.get_engine(app), 2):
+        assert client.get('/dashboard').status_code == 200
+
+def test_assert_max_queries_lists_the_statements(app):
+    engine = db.get_engine(app)
+    with pytest.raises(AssertionError, match='ran 2'):
+        with assert_max_queries(engine, 1):
+            with engine.connect() as conn:
+                conn.exec_driver_sql('SELECT 1')
+                conn.exec_driver_sql('SELECT 2')
+    with count_queries(engine) as queries:
+        with engine.connect() as conn:
+            conn.exec_driver_sql('SELECT 1')
+    assert queries.statements == ['SELECT 1']
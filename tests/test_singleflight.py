@@ -0,0 +1,88 @@
+import asyncio
+import threading
+import time
+from website.api import async_fetch, weatherAPI
+from website.api.singleflight import SingleFlight
+
+def run_threads(count, target):
+    threads = [threading.Thread(target=target) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+def test_concurrent_threads_share_one_call():
+    flights = SingleFlight()
+    calls = []
+    results = []
+    def slow():
+        calls.append(1)
+        time.sleep(0.2)
+        return 'done'
+    run_threads(10, lambda: results.append(flights.do('lima', slow)))
+    assert calls == [1]
+    assert results == ['done'] * 10
+    assert flights.shared == 9
+    assert flights.in_flight() == 0
+
+def test_every_waiter_sees_the_leaders_error():
+    flights = SingleFlight()
+    errors = []
+    def failing():
+        time.sleep(0.2)
+        raise ValueError('upstream down')
+    def call():
+        try:
+            flights.do('lima', failing)
+        except ValueError as error:
+            errors.append(str(error))
+    run_threads(5, call)
+    assert errors == ['upstream down'] * 5
+    assert flights.in_flight() == 0
+
+def test_different_keys_do_not_wait_on_each_other():
+    flights = SingleFlight()
+    calls = []
+    def call(key):
+        flights.do(key, lambda: calls.append(key) or time.sleep(0.1))
+    threads = [threading.Thread(target=call, args=(key,)) for key in ('a', 'b', 'c')]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(calls) == ['a', 'b', 'c']
+
+def test_asyncio_tasks_share_one_call():
+    flights = SingleFlight()
+    calls = []
+    async def slow():
+        calls.append(1)
+        await asyncio.sleep(0.1)
+        return 'done'
+    async def main():
+        return await asyncio.gather(*[flights.do_async('lima', slow) for _ in range(10)])
+    assert asyncio.run(main()) == ['done'] * 10
+    assert calls == [1]
+
+def test_a_task_can_wait_on_a_threads_call():
+    flights = SingleFlight()
+    started = threading.Event()
+    def slow():
+        started.set()
+        time.sleep(0.2)
+        return 'from thread'
+    thread = threading.Thread(target=flights.do, args=('lima', slow))
+    thread.start()
+    started.wait()
+    async def never():
+        raise AssertionError('should have joined the thread')
+    assert asyncio.run(flights.do_async('lima', never)) == 'from thread'
+    thread.join()
+
+def test_identical_misses_reach_upstream_once(fake_upstream):
+    fake_upstream.latency = 0.2
+    run_threads(10, lambda: weatherAPI.fetch_json('Lima'))
+    assert fake_upstream.calls == 1
+    snapshots = async_fetch.fetch_snapshots(['Quito'] * 5 + ['quito '] * 5)
+    assert all(snapshot for snapshot, age in snapshots)
+    assert fake_upstream.calls == 2
@@ -0,0 +1,80 @@
+import sqlite3
+import time
+from website.api import weatherAPI
+from website.api.cache import MAX_STALE, TTLCache
+from website.api.shared_cache import shared_cache
+
+def test_expired_entries_stay_readable_until_max_age():
+    cache = TTLCache(maxsize=10, ttl=60, max_age=600)
+    cache.put('lima', 1, age=120)
+    cache.put('quito', 2, age=601)
+    assert cache.get('lima') is None
+    value, age = cache.get_stale('lima')
+    assert value == 1 and 120 <= age < 121
+    assert cache.get_stale('quito') == (None, None)
+    stats = cache.stats()
+    assert (stats['stale_hits'], stats['expirations']) == (1, 1)
+
+def wait_for_refresh(key):
+    deadline = time.monotonic() + 5
+    while key in weatherAPI._revalidating and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+def test_stale_reading_is_served_at_once_and_refreshed_behind(fake_upstream):
+    weatherAPI.fetch_json('Lima')
+    ttl = weatherAPI.weather_cache.ttl
+    weatherAPI.weather_cache.put('lima', weatherAPI.weather_cache.get('lima'), age=ttl + 60)
+    set_shared_age('lima', ttl + 60)
+    fake_upstream.latency = 0.3
+    started = time.monotonic()
+    data, age = weatherAPI.lookup_json('Lima')
+    assert time.monotonic() - started < 0.2
+    assert age >= ttl + 60
+    wait_for_refresh('lima')
+    assert fake_upstream.calls == 2
+    assert weatherAPI.lookup_json('Lima')[1] < ttl
+
+def test_reading_past_max_stale_waits_for_upstream(fake_upstream):
+    weatherAPI.fetch_json('Lima')
+    weatherAPI.weather_cache.clear()
+    set_shared_age('lima', MAX_STALE + 60)
+    data, age = weatherAPI.lookup_json('Lima')
+    assert age == 0
+    assert fake_upstream.calls == 2
+
+#Another worker holding the refresh lease must not let a copy past MAX_STALE through as fresh
+def test_leased_copy_past_max_stale_is_not_served(fake_upstream):
+    weatherAPI.fetch_json('Lima')
+    weatherAPI.weather_cache.clear()
+    set_shared_age('lima', MAX_STALE + 60, leased=True)
+    data, age = weatherAPI.lookup_json('Lima')
+    assert age == 0
+    assert fake_upstream.calls == 2
+
+def test_leased_copy_within_max_stale_is_served_with_its_age(fake_upstream):
+    weatherAPI.fetch_json('Lima')
+    weatherAPI.weather_cache.clear()
+    set_shared_age('lima', weatherAPI.weather_cache.ttl + 60, leased=True)
+    assert weatherAPI.fetch_json('Lima') is not None
+    assert fake_upstream.calls == 1
+    assert weatherAPI.load_json('Lima', 'lima')[1] >= weatherAPI.weather_cache.ttl + 60
+
+def set_shared_age(key, age, leased=False):
+    with sqlite3.connect(shared_cache.path) as conn:
+        conn.execute('UPDATE weather_cache SET fetched_at = ?, refreshing_until = ? WHERE city = ?',
+                     (time.time() - age, time.time() + 60 if leased else None, key))
+
+def test_weather_page_marks_old_and_undated_readings(app):
+    from website import db
+    from website.models import CityWeather
+    from .helpers import add_city, check_weather, city_id, sign_up
+    client = app.test_client()
+    sign_up(client)
+    add_city(client, 'Lima')
+    check_weather(client, city_id(app, 'tester@example.com', 'Lima'))
+    assert b'id="stale"' not in client.get('/weather').data
+    for updated_at, text in ((int(time.time()) - 3 * 3600, b'Last updated 180 minutes ago'), (None, b'out of date')):
+        with app.app_context():
+            CityWeather.query.filter_by(city_key='lima').update({'updated_at': updated_at})
+            db.session.commit()
+        assert text in client.get('/weather').data
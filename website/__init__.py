@@ -1,16 +1,19 @@
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
-from os import path
 from flask_login import LoginManager
+from sqlalchemy.orm import joinedload
 
-db = SQLAlchemy()
-DB_NAME = "database.db"
+from .config import configure_database
+
+#Rows stay usable after commit, so rendering a page right after a write doesn't re-select them
+db = SQLAlchemy(session_options={'expire_on_commit': False})
 
 
 def create_app():
-    app = Flask(__name__)
+    app = Flask(__name__, instance_relative_config=True)
     app.config['SECRET_KEY'] = 'fsdfshdfuksfsd ffusf'
-    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{DB_NAME}'
+    configure_database(app)
+    app.config.from_pyfile('config.py', silent=True)
     db.init_app(app)
 
     def load_user(id):
@@ -21,20 +24,33 @@ def create_app():
     app.register_blueprint(views, url_prefix='/')
     app.register_blueprint(auth, url_prefix='/')
 
+    from . import instrumentation, metrics
+    instrumentation.init_app(app)
+    metrics.init_app(app, db)
+
     from .models import User, City, CityWeather
     create_database(app)
+
+    from .migrations import db_upgrade_command
+    app.cli.add_command(db_upgrade_command)
+
+    from .api import weatherAPI
+    from .history import recorder, history_compact_command
+    weatherAPI.upstream_listeners.append(recorder(app))
+    app.cli.add_command(history_compact_command)
     
     login_manager = LoginManager()
     login_manager.login_view = 'auth.login'
     login_manager.init_app(app)
     
+    #Runs on every request. The weather row rides along in the same SELECT, and pages that
+    #list cities load them with one extra query, however many cities the user has
     @login_manager.user_loader
     def load_user(id):
-        return User.query.get(int(id))
+        return User.query.options(joinedload(User.weather)).get(int(id))
     
     return app
 
 def create_database(app):
-    if not path.exists('website/' + DB_NAME):
-        db.create_all(app=app)
-        print("created database")
\ No newline at end of file
+    from .migrations import upgrade
+    upgrade(app, db)
\ No newline at end of file
@@ -0,0 +1,68 @@
+import asyncio
+import os
+import time
+import aiohttp
+from . import weatherAPI
+from .cache import normalize_city
+from .shared_cache import shared_cache
+from .client import client
+from .breaker import CircuitOpenError
+
+CONCURRENCY = int(os.environ.get('WEATHER_ASYNC_CONCURRENCY', 10))
+REQUEST_TIMEOUT = float(os.environ.get('WEATHER_ASYNC_TIMEOUT', 5))
+
+#(data, age in seconds) like weatherAPI.load_json, so threads and tasks can share each other's result
+async def _load_one(session, semaphore, city, key):
+    data, age = weatherAPI.shared_json(key)
+    if data is not None:
+        return data, age
+    try:
+        client.breaker.before_call()
+    except CircuitOpenError:
+        shared_cache.release(key)
+        raise
+    async with semaphore:
+        started = time.perf_counter()
+        try:
+            async with session.get(weatherAPI.city_url(city)) as response:
+                client.notify(time.perf_counter() - started, response.status)
+                response.raise_for_status()
+                data = await response.json(content_type=None)
+        except aiohttp.ClientResponseError:
+            shared_cache.release(key)
+            raise
+        except Exception:
+            client.notify(time.perf_counter() - started, None)
+            shared_cache.release(key)
+            raise
+    weatherAPI.store_json(key, data)
+    return data, 0
+
+#Shares in-flight fetches with other tasks and with threads using the sync client.
+#When upstream fails, an older copy is better than an empty row
+async def _fetch_one(session, semaphore, city):
+    key = normalize_city(city)
+    data, age = weatherAPI.weather_cache.get_stale(key)
+    if data is None or age >= weatherAPI.weather_cache.ttl:
+        try:
+            data, age = await weatherAPI.flights.do_async(key, lambda: _load_one(session, semaphore, city, key))
+        except Exception:
+            data, age = weatherAPI.fallback_json(key)
+            if data is None:
+                raise
+    return weatherAPI.WeatherSnapshot.from_json(city, data), age
+
+#(snapshot, age in seconds) in the same order as cities, with (None, None) for any city that failed or timed out.
+async def fetch_snapshots_async(cities, concurrency=CONCURRENCY, timeout=REQUEST_TIMEOUT):
+    semaphore = asyncio.Semaphore(concurrency)
+    client_timeout = aiohttp.ClientTimeout(total=timeout)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(timeout=client_timeout, connector=connector) as session:
+        results = await asyncio.gather(*[_fetch_one(session, semaphore, city) for city in cities], return_exceptions=True)
+    return [(None, None) if isinstance(result, BaseException) else result for result in results]
+
+#Entry point for the sync Flask views
+def fetch_snapshots(cities, concurrency=CONCURRENCY, timeout=REQUEST_TIMEOUT):
+    if not cities:
+        return []
+    return asyncio.run(fetch_snapshots_async(cities, concurrency, timeout))
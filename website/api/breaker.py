@@ -0,0 +1,79 @@
+import os
+import threading
+import time
+
+#Consecutive failed or slow upstream calls before we stop calling OpenWeatherMap
+FAILURE_THRESHOLD = int(os.environ.get('WEATHER_BREAKER_FAILURES', 5))
+#Calls slower than this count as failures even when they succeed
+SLOW_CALL = float(os.environ.get('WEATHER_BREAKER_SLOW', 4))
+#How long the breaker stays open before letting one probe call through
+RESET_TIMEOUT = float(os.environ.get('WEATHER_BREAKER_RESET', 30))
+
+CLOSED = 'closed'
+HALF_OPEN = 'half_open'
+OPEN = 'open'
+STATES = (CLOSED, HALF_OPEN, OPEN)
+
+class CircuitOpenError(Exception):
+    pass
+
+#Closed: calls go through. Open: calls fail at once until reset_timeout has passed.
+#Half open: one probe goes through, its outcome closes or reopens the breaker
+class CircuitBreaker:
+    def __init__(self, failure_threshold=FAILURE_THRESHOLD, slow_call=SLOW_CALL, reset_timeout=RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.slow_call = slow_call
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.rejected = 0
+        self.trips = 0
+        self._opened_at = 0.0
+        self._probe_at = None
+        self._lock = threading.Lock()
+        #Called with the new state whenever it changes
+        self.observers = []
+
+    def _set_state(self, state):
+        if state == self.state:
+            return
+        self.state = state
+        for observer in self.observers:
+            observer(state)
+
+    #Raises CircuitOpenError instead of letting a call through
+    def before_call(self):
+        with self._lock:
+            now = time.monotonic()
+            if self.state == OPEN and now - self._opened_at >= self.reset_timeout:
+                self._set_state(HALF_OPEN)
+                self._probe_at = None
+            if self.state == HALF_OPEN:
+                #A probe that never reported back must not keep the breaker half open forever
+                if self._probe_at is None or now - self._probe_at >= self.reset_timeout:
+                    self._probe_at = now
+                    return
+            if self.state != CLOSED:
+                self.rejected += 1
+                raise CircuitOpenError('OpenWeatherMap circuit is open')
+
+    #Same signature as WeatherClient observers: (seconds, status code or None on a network error)
+    def record(self, elapsed, status):
+        failed = status is None or status == 429 or status >= 500 or elapsed >= self.slow_call
+        with self._lock:
+            if not failed:
+                self.failures = 0
+                self._probe_at = None
+                self._set_state(CLOSED)
+                return
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    self.trips += 1
+                self._opened_at = time.monotonic()
+                self._probe_at = None
+                self._set_state(OPEN)
+
+    def stats(self):
+        with self._lock:
+            return {'state': self.state, 'failures': self.failures, 'rejected': self.rejected, 'trips': self.trips}
@@ -0,0 +1,104 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+#OpenWeatherMap refreshes current conditions about every 10 minutes
+CACHE_TTL = float(os.environ.get('WEATHER_CACHE_TTL', 600))
+CACHE_SIZE = int(os.environ.get('WEATHER_CACHE_SIZE', 512))
+#Past the TTL a city may still be shown, marked stale, while it refreshes in the background. Older than this we wait for upstream
+MAX_STALE = max(float(os.environ.get('WEATHER_MAX_STALE', 3600)), CACHE_TTL)
+
+COUNTRY_ALIASES = {'uk': 'gb'}
+
+#"  new  york , US" and "New York,us" should share one cache entry
+def normalize_city(name):
+    parts = [re.sub(r'\s+', ' ', part).strip().lower() for part in name.split(',')]
+    parts = [part for part in parts if part]
+    if len(parts) > 1:
+        parts[-1] = COUNTRY_ALIASES.get(parts[-1], parts[-1])
+    return ','.join(parts)
+
+#Bounded LRU whose entries also expire after ttl seconds.
+#Expired entries are kept until max_age so get_stale can still return them
+class TTLCache:
+    def __init__(self, maxsize=CACHE_SIZE, ttl=CACHE_TTL, max_age=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_age = ttl if max_age is None else max(max_age, ttl)
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        return self._lookup(key, False)[0]
+
+    #(value, age in seconds) for anything younger than max_age, otherwise (None, None)
+    def get_stale(self, key):
+        return self._lookup(key, True)
+
+    def _lookup(self, key, stale_ok):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None, None
+            value, stored_at = entry
+            age = now - stored_at
+            if age >= self.max_age:
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return None, None
+            if age >= self.ttl:
+                if not stale_ok:
+                    self.misses += 1
+                    return None, None
+                self.stale_hits += 1
+                return value, age
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value, age
+
+    #age backdates the entry, for values that were already that old when we got them
+    def put(self, key, value, age=0):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() - age)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'stale_hits': self.stale_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+            }
+
+weather_cache = TTLCache(max_age=MAX_STALE)
@@ -0,0 +1,53 @@
+import os
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from .breaker import CircuitBreaker
+
+#Each gunicorn worker gets its own client, so the pool only needs to cover that worker's threads
+POOL_SIZE = int(os.environ.get('WEATHER_POOL_SIZE', 10))
+CONNECT_TIMEOUT = float(os.environ.get('WEATHER_CONNECT_TIMEOUT', 3.05))
+READ_TIMEOUT = float(os.environ.get('WEATHER_READ_TIMEOUT', 5))
+RETRIES = int(os.environ.get('WEATHER_RETRIES', 2))
+BACKOFF = float(os.environ.get('WEATHER_BACKOFF', 0.3))
+
+#Keep-alive session shared by every OpenWeatherMap call in this process
+class WeatherClient:
+    def __init__(self, pool_size=POOL_SIZE, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT, retries=RETRIES, backoff=BACKOFF):
+        self.timeout = (connect_timeout, read_timeout)
+        retry = Retry(total=retries, connect=retries, read=retries, backoff_factor=backoff,
+                      status_forcelist=(429, 500, 502, 503, 504), allowed_methods=('GET',),
+                      raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        #Fails calls fast while OpenWeatherMap is down or too slow, instead of tying up every worker thread
+        self.breaker = CircuitBreaker()
+        #Called with (seconds, status code or None on a network error) after every upstream call
+        self.observers = [self.breaker.record]
+
+    def notify(self, elapsed, status):
+        for observer in self.observers:
+            observer(elapsed, status)
+
+    #Raises CircuitOpenError without calling upstream while the breaker is open
+    def get(self, url):
+        self.breaker.before_call()
+        started = time.perf_counter()
+        try:
+            response = self.session.get(url, timeout=self.timeout)
+        except Exception:
+            self.notify(time.perf_counter() - started, None)
+            raise
+        self.notify(time.perf_counter() - started, response.status_code)
+        return response
+
+    def get_json(self, url):
+        return self.get(url).json()
+
+    def close(self):
+        self.session.close()
+
+client = WeatherClient()
@@ -0,0 +1,95 @@
+import json
+import random
+import sys
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+#Offline stand-in for the OpenWeatherMap endpoints we call: /weather?q=, /weather?id= and /group?id=
+#Cities whose name starts with "nowhere" answer 404 like an unknown city does upstream
+
+def city_id(name):
+    return zlib.crc32(name.strip().lower().encode()) % 10000000
+
+def city_payload(name, owm_id=None):
+    owm_id = city_id(name) if owm_id is None else owm_id
+    rng = random.Random(owm_id)
+    temp = round(rng.uniform(250, 310), 2)
+    return {
+        'id': owm_id,
+        'name': name,
+        #Upstream publishes a new reading about every 10 minutes
+        'dt': int(time.time()) // 600 * 600,
+        'main': {'temp': temp, 'temp_min': round(temp - rng.uniform(0, 5), 2), 'temp_max': round(temp + rng.uniform(0, 5), 2)},
+        'weather': [{'description': rng.choice(['clear sky', 'few clouds', 'light rain', 'mist', 'snow'])}],
+        'wind': {'speed': round(rng.uniform(0, 15), 2), 'deg': rng.randrange(360)},
+    }
+
+class FakeUpstream:
+    def __init__(self, latency=0.0, error_rate=0.0, host='127.0.0.1', port=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.calls = 0
+        self.names = {}
+        upstream = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                upstream.calls += 1
+                status, body = upstream.respond(self.path)
+                if upstream.latency:
+                    time.sleep(upstream.latency)
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return 'http://%s:%d/data/2.5/weather?' % (host, port)
+
+    def respond(self, path):
+        url = urlparse(path)
+        query = parse_qs(url.query)
+        if self.error_rate and random.random() < self.error_rate:
+            return 503, {'cod': 503, 'message': 'service unavailable'}
+        if url.path.endswith('/group'):
+            ids = [int(i) for i in query.get('id', [''])[0].split(',') if i]
+            if len(ids) > 20:
+                return 400, {'cod': '400', 'message': 'too many ids'}
+            items = [city_payload(self.names.get(i, str(i)), i) for i in ids]
+            return 200, {'cnt': len(items), 'list': items}
+        name = query.get('q', [''])[0]
+        if not name.strip() or name.strip().lower().startswith('nowhere'):
+            return 404, {'cod': '404', 'message': 'city not found'}
+        payload = city_payload(name)
+        self.names[payload['id']] = name
+        return 200, payload
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name='fake-upstream', daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+#python -m website.api.fake_upstream [port] [latency] [error_rate]
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    upstream = FakeUpstream(port=int(args[0]) if args else 8081,
+                            latency=float(args[1]) if len(args) > 1 else 0.0,
+                            error_rate=float(args[2]) if len(args) > 2 else 0.0)
+    print('Fake OpenWeatherMap at ' + upstream.base_url)
+    upstream.server.serve_forever()
@@ -0,0 +1,124 @@
+import gzip
+import json
+import os
+import threading
+import heapq
+from bisect import bisect_left
+from .cache import normalize_city
+
+#OpenWeatherMap's city list (http://bulk.openweathermap.org/sample/city.list.json.gz), plain or gzipped.
+#Entries may also carry a "population" field, which autocomplete uses for ranking
+#A prefix matching more cities than this is answered from its population-ordered bucket instead
+MAX_SCAN = 500
+
+CITY_LIST_PATH = os.environ.get('WEATHER_CITY_LIST', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'city.list.json.gz'))
+
+#Sorted "name,cc" keys with parallel arrays, so lookups are a bisect and the index stays a few flat lists
+class Gazetteer:
+    def __init__(self, entries=()):
+        rows = {}
+        for name, country, population in entries:
+            key = normalize_city(name + ',' + country if country else name)
+            if key and (key not in rows or population > rows[key][2]):
+                rows[key] = (name, country, population)
+        self.keys = sorted(rows)
+        self.names = [rows[key][0] for key in self.keys]
+        self.countries = [rows[key][1] for key in self.keys]
+        self.populations = [rows[key][2] for key in self.keys]
+        #Indexes by first one and first two characters, most populous first, for short prefixes
+        self.buckets = {}
+        for i in sorted(range(len(self.keys)), key=lambda i: -self.populations[i]):
+            for length in (1, 2):
+                self.buckets.setdefault(self.keys[i][:length], []).append(i)
+
+    @classmethod
+    def load(cls, path=CITY_LIST_PATH):
+        if not path or not os.path.exists(path):
+            return cls()
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rt', encoding='utf-8') as f:
+            cities = json.load(f)
+        return cls((city['name'], city.get('country', ''), city.get('population', 0)) for city in cities)
+
+    def __len__(self):
+        return len(self.keys)
+
+    #Index of the first key starting with prefix
+    def lower_bound(self, prefix):
+        return bisect_left(self.keys, prefix)
+
+    #"Paris" matches any country, "Paris, FR" only that one
+    def contains(self, city):
+        key = normalize_city(city)
+        if not key:
+            return False
+        i = self.lower_bound(key)
+        if i < len(self.keys) and self.keys[i] == key:
+            return True
+        if ',' in key:
+            return False
+        #Space sorts before ',', so "london colney,gb" comes before "london,gb" and we bisect past it
+        i = self.lower_bound(key + ',')
+        return i < len(self.keys) and self.keys[i].startswith(key + ',')
+
+    #Indexes of the keys for one city name in any country, or for one exact "name,cc"
+    def matches(self, key):
+        found = []
+        i = self.lower_bound(key)
+        if i < len(self.keys) and self.keys[i] == key:
+            found.append(i)
+        if ',' not in key:
+            i = self.lower_bound(key + ',')
+            while i < len(self.keys) and self.keys[i].startswith(key + ','):
+                found.append(i)
+                i += 1
+        return found
+
+    #The count most populous cities starting with prefix
+    def most_populous(self, prefix, count):
+        start = self.lower_bound(prefix)
+        end = bisect_left(self.keys, prefix + '\uffff')
+        if end - start <= MAX_SCAN:
+            return heapq.nlargest(count, range(start, end), key=self.populations.__getitem__)
+        #So many cities match that walking the bucket in population order finds them quickly
+        found = []
+        for i in self.buckets.get(prefix[:2], ()):
+            if self.keys[i].startswith(prefix):
+                found.append(i)
+                if len(found) == count:
+                    break
+        return found
+
+    #Best matches for a prefix: cities our users track first, most tracked first, then by population.
+    #popular is the tracked cities' keys already in that order
+    def complete(self, prefix, limit=10, popular=()):
+        prefix = normalize_city(prefix)
+        if not prefix:
+            return []
+        ranked = []
+        for key in popular:
+            if key.startswith(prefix):
+                ranked.extend(sorted(self.matches(key), key=lambda i: -self.populations[i]))
+        ranked.extend(self.most_populous(prefix, limit + len(ranked)))
+        seen = set()
+        best = []
+        for i in ranked:
+            if i not in seen:
+                seen.add(i)
+                best.append(i)
+                if len(best) == limit:
+                    break
+        return [{'name': self.names[i], 'country': self.countries[i],
+                 'label': self.names[i] + ', ' + self.countries[i] if self.countries[i] else self.names[i]} for i in best]
+
+_gazetteer = None
+_lock = threading.Lock()
+
+#Loaded on first use, once per worker
+def get_gazetteer():
+    global _gazetteer
+    if _gazetteer is None:
+        with _lock:
+            if _gazetteer is None:
+                _gazetteer = Gazetteer.load()
+    return _gazetteer
@@ -0,0 +1,97 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from .cache import CACHE_TTL
+
+#Sibling of database.db so the app's own tables and locks stay separate
+SHARED_CACHE_PATH = os.environ.get('WEATHER_SHARED_CACHE', os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'weather_cache.db'))
+#How long one worker may hold the refresh lease before another can take over
+REFRESH_LEASE = float(os.environ.get('WEATHER_REFRESH_LEASE', 15))
+
+#Raw upstream JSON shared by every gunicorn worker on this host
+class SharedCache:
+    def __init__(self, path=SHARED_CACHE_PATH, ttl=CACHE_TTL, lease=REFRESH_LEASE):
+        self.path = path
+        self.ttl = ttl
+        self.lease = lease
+        self._local = threading.local()
+        self._ids = {}
+        if self.path:
+            with self._connect() as conn:
+                conn.execute('CREATE TABLE IF NOT EXISTS weather_cache ('
+                             'city TEXT PRIMARY KEY, payload TEXT NOT NULL, '
+                             'fetched_at REAL NOT NULL, refreshing_until REAL)')
+                #OpenWeatherMap city IDs learned from earlier responses, needed by the group endpoint
+                conn.execute('CREATE TABLE IF NOT EXISTS city_id ('
+                             'city TEXT PRIMARY KEY, owm_id INTEGER NOT NULL)')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    #SQLite connections must not cross fork(), a worker forked from a preloaded master starts fresh
+    def reset(self):
+        self._local = threading.local()
+
+    #Returns (data, fresh) or (None, False) when the city has never been stored
+    def get(self, city):
+        data, age = self.get_stale(city)
+        return data, data is not None and age < self.ttl
+
+    #Returns (data, age in seconds) or (None, None) when the city has never been stored
+    def get_stale(self, city):
+        if not self.path:
+            return None, None
+        row = self._connect().execute('SELECT payload, fetched_at FROM weather_cache WHERE city = ?', (city,)).fetchone()
+        if row is None:
+            return None, None
+        return json.loads(row[0]), max(time.time() - row[1], 0)
+
+    #Only one caller wins the lease for an expired city, the rest keep serving stale data
+    def claim_refresh(self, city):
+        if not self.path:
+            return True
+        now = time.time()
+        cur = self._connect().execute('UPDATE weather_cache SET refreshing_until = ? WHERE city = ? '
+                                      'AND (refreshing_until IS NULL OR refreshing_until < ?)',
+                                      (now + self.lease, city, now))
+        return cur.rowcount == 1
+
+    def release(self, city):
+        if self.path:
+            self._connect().execute('UPDATE weather_cache SET refreshing_until = NULL WHERE city = ?', (city,))
+
+    def put(self, city, data):
+        if self.path:
+            self._connect().execute('INSERT OR REPLACE INTO weather_cache (city, payload, fetched_at, refreshing_until) '
+                                    'VALUES (?, ?, ?, NULL)', (city, json.dumps(data), time.time()))
+
+    def put_city_id(self, city, owm_id):
+        if self._ids.get(city) == owm_id:
+            return
+        self._ids[city] = owm_id
+        if self.path:
+            self._connect().execute('INSERT OR REPLACE INTO city_id (city, owm_id) VALUES (?, ?)', (city, owm_id))
+
+    #{city: owm_id} for the cities whose ID we already know
+    def city_ids(self, cities):
+        known = {city: self._ids[city] for city in cities if city in self._ids}
+        missing = [city for city in cities if city not in known]
+        if self.path and missing:
+            conn = self._connect()
+            for start in range(0, len(missing), 500):
+                chunk = missing[start:start + 500]
+                rows = conn.execute('SELECT city, owm_id FROM city_id WHERE city IN (%s)' % ','.join('?' * len(chunk)), chunk)
+                for city, owm_id in rows:
+                    self._ids[city] = owm_id
+                    known[city] = owm_id
+        return known
+
+shared_cache = SharedCache()
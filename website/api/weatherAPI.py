@@ -1,42 +1,259 @@
 import datetime as dt
-import requests
+import logging
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from .breaker import CircuitOpenError
+from .client import client
+from .cache import weather_cache, normalize_city, TTLCache, MAX_STALE
+from .gazetteer import get_gazetteer
+from .shared_cache import shared_cache
+from .singleflight import SingleFlight
 
-BASE_URL="http://api.openweathermap.org/data/2.5/weather?"
+BASE_URL=os.environ.get('WEATHER_BASE_URL', "http://api.openweathermap.org/data/2.5/weather?")
+log = logging.getLogger(__name__)
+#The group endpoint takes at most 20 city IDs per call
+GROUP_SIZE = 20
+#Upstream answers to "does this city exist", kept much longer than weather since they rarely change
+VALIDATION_TTL = float(os.environ.get('WEATHER_VALIDATION_TTL', 86400))
+#What an upstream call raises when OpenWeatherMap is down, slow or the breaker is open
+UPSTREAM_ERRORS = (CircuitOpenError, requests.RequestException)
+#Upstream fetches currently in progress, keyed by normalized city
+flights = SingleFlight()
+#Background refreshes of stale cities, at most one queued per city
+revalidator = ThreadPoolExecutor(max_workers=int(os.environ.get('WEATHER_REVALIDATE_THREADS', 2)), thread_name_prefix='revalidate')
+_revalidating = set()
+_revalidating_lock = threading.Lock()
+#Called with (normalized city, raw JSON) after every successful upstream fetch
+upstream_listeners = []
+validation_cache = TTLCache(maxsize=int(os.environ.get('WEATHER_VALIDATION_SIZE', 4096)), ttl=VALIDATION_TTL)
 API_KEY=open(os.getcwd() + '/website/api/apikey.txt', 'r').read()
 
+#Everything we show for one city, pulled out of a single upstream response
+class WeatherSnapshot:
+    __slots__ = ('name', 'temps', 'temp_max', 'temp_min', 'description', 'wind_speed', 'wind_dir')
+
+    def __init__(self, name, temps, temp_max, temp_min, description, wind_speed, wind_dir):
+        self.name = name
+        self.temps = temps
+        self.temp_max = temp_max
+        self.temp_min = temp_min
+        self.description = description
+        self.wind_speed = wind_speed
+        self.wind_dir = wind_dir
+
+    @classmethod
+    def from_json(cls, name, data):
+        main = data['main']
+        wind = data['wind']
+        return cls(name,
+                   kelvin_to_celsius_fahrenheit(main['temp']),
+                   main['temp_max'],
+                   main['temp_min'],
+                   data['weather'][0]['description'],
+                   wind['speed'],
+                   wind.get('deg', 0))
+
+def city_url(CITY):
+    return BASE_URL + "appid=" + API_KEY + "&q=" + CITY
+
+def group_url(ids):
+    return BASE_URL.replace('/weather?', '/group?') + "appid=" + API_KEY + "&id=" + ','.join(str(i) for i in ids)
+
 def requestItemMain(url, item):
-    return requests.get(url).json()['main'][item]
+    return client.get_json(url)['main'][item]
 
 
+#Bundled city list first, then anything we already fetched, then remembered upstream answers.
+#Only a name none of those know about costs an upstream call. Raises when upstream can't answer
 def check_if_city_exists(CITY):
-    url = BASE_URL + "appid=" + API_KEY + "&q=" + CITY
-    return requests.get(url)
+    key = normalize_city(CITY)
+    if not key:
+        return False
+    if get_gazetteer().contains(key):
+        return True
+    if weather_cache.get(key) is not None or shared_cache.get(key)[0] is not None:
+        return True
+    known = validation_cache.get(key)
+    if known is not None:
+        return known
+    response = client.get(city_url(CITY))
+    if response.status_code == 404:
+        validation_cache.put(key, False)
+        return False
+    #Outages, rate limits and a bad API key say nothing about the city, let the caller retry later
+    response.raise_for_status()
+    store_json(key, response.json())
+    validation_cache.put(key, True)
+    return True
     
 def kelvin_to_celsius_fahrenheit(kelvin):
     celsius = kelvin-273.15
     fahrenheit = celsius*(9/5) + 32
     return celsius, fahrenheit, kelvin
 
+def fetch_upstream(CITY):
+    response = client.get(city_url(CITY))
+    response.raise_for_status()
+    return response.json()
+
+#The cache shared by all workers, as (data, age in seconds). (None, None) means the caller should go upstream.
+#While another worker refreshes an expired city we serve its stale copy, but never one past MAX_STALE
+def shared_json(key):
+    data, age = shared_cache.get_stale(key)
+    if data is not None and (age < shared_cache.ttl or (age < MAX_STALE and not shared_cache.claim_refresh(key))):
+        weather_cache.put(key, data, age)
+        return data, age
+    return None, None
+
+def store_json(key, data):
+    shared_cache.put(key, data)
+    weather_cache.put(key, data)
+    if 'id' in data:
+        shared_cache.put_city_id(key, data['id'])
+    for listener in upstream_listeners:
+        try:
+            listener(key, data)
+        except Exception:
+            log.exception('upstream listener failed')
+
+#(data, age in seconds), age 0 when it came straight from upstream
+def load_json(CITY, key):
+    data, age = shared_json(key)
+    if data is not None:
+        return data, age
+    try:
+        data = fetch_upstream(CITY)
+    except Exception:
+        shared_cache.release(key)
+        raise
+    store_json(key, data)
+    return data, 0
+
+#Raw upstream JSON for a city, only going upstream when neither cache can answer.
+#Concurrent misses for the same city wait on one fetch instead of each calling upstream
+def fetch_json(CITY):
+    key = normalize_city(CITY)
+    data = weather_cache.get(key)
+    if data is not None:
+        return data
+    return flights.do(key, lambda: load_json(CITY, key))[0]
+
+#One upstream call for everything the weather page needs
+def fetch_snapshot(CITY):
+    return WeatherSnapshot.from_json(CITY, fetch_json(CITY))
+
+def _revalidate(CITY, key):
+    try:
+        flights.do(key, lambda: load_json(CITY, key))
+    except CircuitOpenError:
+        pass
+    except Exception:
+        log.warning('background refresh of %s failed', key, exc_info=True)
+    finally:
+        with _revalidating_lock:
+            _revalidating.discard(key)
+
+def revalidate_later(CITY, key):
+    with _revalidating_lock:
+        if key in _revalidating:
+            return
+        _revalidating.add(key)
+    revalidator.submit(_revalidate, CITY, key)
+
+#Last resort while upstream is failing: the newest copy we have, however old. (None, None) if there is none
+def fallback_json(key):
+    data, age = weather_cache.get_stale(key)
+    if data is None:
+        data, age = shared_cache.get_stale(key)
+    return data, age
+
+#Stale-while-revalidate: (raw JSON, age in seconds). Anything younger than MAX_STALE is answered from a cache
+#right away, refreshing it in the background once it is past the TTL. Older than that we wait for upstream
+def lookup_json(CITY):
+    key = normalize_city(CITY)
+    data, age = weather_cache.get_stale(key)
+    if data is None or age >= weather_cache.ttl:
+        #Another worker may hold a newer copy
+        shared, shared_age = shared_cache.get_stale(key)
+        if shared is not None and shared_age < MAX_STALE and (data is None or shared_age < age):
+            data, age = shared, shared_age
+            weather_cache.put(key, data, age)
+    if data is None:
+        try:
+            return flights.do(key, lambda: load_json(CITY, key))
+        except UPSTREAM_ERRORS:
+            data, age = fallback_json(key)
+            if data is None:
+                raise
+            log.warning('upstream unavailable, serving %s from %d seconds ago', key, age)
+            return data, age
+    if age >= weather_cache.ttl:
+        revalidate_later(CITY, key)
+    return data, age
+
+def lookup_snapshot(CITY):
+    data, age = lookup_json(CITY)
+    return WeatherSnapshot.from_json(CITY, data), age
+
 #Return temps in order C, F, K, Max, Min
 def getTemps(CITY):
-    url = BASE_URL + "appid=" + API_KEY + "&q=" + CITY
-    temp_kelvin = requestItemMain(url, "temp")
-    temps = kelvin_to_celsius_fahrenheit(temp_kelvin)
-    temp_max = requestItemMain(url, 'temp_max')
-    temp_min = requestItemMain(url, 'temp_min')
-    return temps, temp_max, temp_min
+    snapshot = fetch_snapshot(CITY)
+    return snapshot.temps, snapshot.temp_max, snapshot.temp_min
 
 #Return description of sky
 def getDescription(CITY):
-    url = BASE_URL + "appid=" + API_KEY + "&q=" + CITY
-    return requests.get(url).json()['weather'][0]['description']
+    return fetch_snapshot(CITY).description
 
 #Wind speed and degree
 def getWind(CITY):
-    url = BASE_URL + "appid=" + API_KEY + "&q=" + CITY
-    wind = requests.get(url).json()['wind']
-    speed = wind['speed']
-    dir = wind['deg']
-    return speed, dir
+    snapshot = fetch_snapshot(CITY)
+    return snapshot.wind_speed, snapshot.wind_dir
 
+#Refresh many cities with one upstream call per 20 known city IDs.
+#Cities we have never resolved to an ID, or whose group call failed, fall back to single-city requests.
+#throttle is called before every upstream call, so a caller can keep all of them under a quota
+def fetch_group(cities, throttle=None):
+    keys = [normalize_city(city) for city in cities]
+    ids = shared_cache.city_ids(keys)
+    results = {}
+    upstream_down = False
+    known = sorted(set(ids.values()))
+    for start in range(0, len(known), GROUP_SIZE):
+        chunk = known[start:start + GROUP_SIZE]
+        if throttle:
+            throttle()
+        try:
+            response = client.get(group_url(chunk))
+            response.raise_for_status()
+        except CircuitOpenError:
+            upstream_down = True
+            break
+        except UPSTREAM_ERRORS:
+            log.warning('group call for %d cities failed, fetching them one by one', len(chunk), exc_info=True)
+            continue
+        for item in response.json().get('list', []):
+            results[item['id']] = item
+    snapshots = []
+    for city, key in zip(cities, keys):
+        data = results.get(ids.get(key))
+        if data is None:
+            #No point waiting on the quota for calls the breaker would reject anyway
+            if upstream_down:
+                snapshots.append(None)
+                continue
+            if throttle:
+                throttle()
+            try:
+                data = fetch_upstream(city)
+            except CircuitOpenError:
+                upstream_down = True
+                snapshots.append(None)
+                continue
+            except Exception:
+                snapshots.append(None)
+                continue
+        store_json(key, data)
+        snapshots.append(WeatherSnapshot.from_json(city, data))
+    return snapshots
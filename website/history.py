@@ -0,0 +1,71 @@
+import os
+import time
+import click
+from sqlalchemy import select, text
+from sqlalchemy.exc import IntegrityError
+from . import db
+from .models import Observation
+
+#Full resolution for a week, hourly after that, nothing older than a year
+RAW_DAYS = int(os.environ.get('HISTORY_RAW_DAYS', 7))
+RETENTION_DAYS = int(os.environ.get('HISTORY_RETENTION_DAYS', 365))
+DOWNSAMPLE_SECONDS = int(os.environ.get('HISTORY_DOWNSAMPLE_SECONDS', 3600))
+
+def scaled(value):
+    return None if value is None else int(round(value * 100))
+
+def observation_row(data):
+    main = data['main']
+    wind = data.get('wind', {})
+    return {'owm_id': data['id'],
+            'observed_at': int(data.get('dt') or time.time()),
+            'temp_k': scaled(main['temp']),
+            'temp_min': scaled(main.get('temp_min')),
+            'temp_max': scaled(main.get('temp_max')),
+            'wind_speed': scaled(wind.get('speed')),
+            'wind_dir': wind.get('deg'),
+            'description': data['weather'][0]['description'][:150]}
+
+#Listener for weatherAPI.upstream_listeners. Upstream only changes its reading every ~10 minutes,
+#so a second fetch of the same reading is a no-op rather than a new row.
+#Writes through its own connection so it never touches the request's session
+def recorder(app):
+    table = Observation.__table__
+    def record(key, data):
+        if 'id' not in data or 'main' not in data:
+            return
+        row = observation_row(data)
+        try:
+            with db.get_engine(app).begin() as conn:
+                exists = conn.execute(select(table.c.owm_id).where(table.c.owm_id == row['owm_id'],
+                                                                   table.c.observed_at == row['observed_at'])).first()
+                if exists is None:
+                    conn.execute(table.insert(), row)
+        except IntegrityError:
+            pass
+    return record
+
+#Oldest first, served from the primary key index
+def history(owm_id, since=None, limit=1000):
+    query = Observation.query.filter(Observation.owm_id == owm_id)
+    if since is not None:
+        query = query.filter(Observation.observed_at >= since)
+    return query.order_by(Observation.observed_at).limit(limit).all()
+
+#Drop rows past retention and keep one row per city per DOWNSAMPLE_SECONDS past RAW_DAYS
+def compact(now=None, raw_days=RAW_DAYS, retention_days=RETENTION_DAYS, bucket=DOWNSAMPLE_SECONDS):
+    now = int(now or time.time())
+    raw_cutoff = now - raw_days * 86400
+    retention_cutoff = now - retention_days * 86400
+    expired = db.session.execute(text('DELETE FROM observation WHERE observed_at < :cutoff'), {'cutoff': retention_cutoff}).rowcount
+    downsampled = db.session.execute(text(
+        'DELETE FROM observation WHERE observed_at < :raw_cutoff AND (owm_id, observed_at) NOT IN ('
+        'SELECT owm_id, MIN(observed_at) FROM observation WHERE observed_at < :raw_cutoff '
+        'GROUP BY owm_id, observed_at / :bucket)'), {'raw_cutoff': raw_cutoff, 'bucket': bucket}).rowcount
+    db.session.commit()
+    return expired, downsampled
+
+@click.command('history-compact')
+def history_compact_command():
+    expired, downsampled = compact()
+    click.echo('removed %d expired and %d downsampled observations' % (expired, downsampled))
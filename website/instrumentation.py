@@ -0,0 +1,101 @@
+import logging
+import os
+import threading
+import time
+from flask import g, has_request_context, jsonify, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from .api.client import client
+from .api.cache import weather_cache
+from .api.weatherAPI import flights
+
+#Statements slower than this are logged with their SQL. Never the bound values, which hold emails and password hashes
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 100))
+
+log = logging.getLogger(__name__)
+
+#Totals per endpoint since this worker started, served by /stats
+_totals = {}
+_totals_lock = threading.Lock()
+
+def _request_stats():
+    if not has_request_context():
+        return None
+    stats = g.get('perf')
+    if stats is None:
+        stats = g.perf = {'db_count': 0, 'db_time': 0.0, 'upstream_count': 0, 'upstream_time': 0.0, 'upstream_errors': 0}
+    return stats
+
+#The start time lives on the statement's own execution context, so a statement that raises leaves nothing behind
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context.query_started = time.perf_counter()
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, 'query_started', None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        log.warning('slow query (%.1f ms): %s', elapsed * 1000, statement)
+    stats = _request_stats()
+    if stats is not None:
+        stats['db_count'] += 1
+        stats['db_time'] += elapsed
+
+def _record_upstream(elapsed, status):
+    stats = _request_stats()
+    if stats is not None:
+        stats['upstream_count'] += 1
+        stats['upstream_time'] += elapsed
+        if status is None or status >= 500:
+            stats['upstream_errors'] += 1
+
+def _server_timing(stats, total):
+    return ', '.join([
+        'db;dur=%.1f;desc="%d queries"' % (stats['db_time'] * 1000, stats['db_count']),
+        'upstream;dur=%.1f;desc="%d calls"' % (stats['upstream_time'] * 1000, stats['upstream_count']),
+        'total;dur=%.1f' % (total * 1000),
+    ])
+
+def init_app(app):
+    client.observers.append(_record_upstream)
+
+    @app.before_request
+    def start_timer():
+        g.perf_started = time.perf_counter()
+        _request_stats()
+
+    @app.after_request
+    def add_server_timing(response):
+        stats = g.get('perf')
+        started = g.get('perf_started')
+        if stats is None or started is None:
+            return response
+        total = time.perf_counter() - started
+        response.headers['Server-Timing'] = _server_timing(stats, total)
+        endpoint = request.endpoint or 'unknown'
+        with _totals_lock:
+            totals = _totals.setdefault(endpoint, {'requests': 0, 'total_time': 0.0, 'db_count': 0, 'db_time': 0.0,
+                                                   'upstream_count': 0, 'upstream_time': 0.0, 'upstream_errors': 0})
+            totals['requests'] += 1
+            totals['total_time'] += total
+            for name, value in stats.items():
+                totals[name] += value
+        return response
+
+    @app.route('/stats')
+    def stats():
+        with _totals_lock:
+            endpoints = {endpoint: dict(totals) for endpoint, totals in _totals.items()}
+        for totals in endpoints.values():
+            requests = totals['requests']
+            totals['avg_ms'] = totals['total_time'] * 1000 / requests
+            totals['avg_db_ms'] = totals['db_time'] * 1000 / requests
+            totals['avg_upstream_ms'] = totals['upstream_time'] * 1000 / requests
+        return jsonify({'pid': os.getpid(), 'slow_query_ms': SLOW_QUERY_MS,
+                        'endpoints': endpoints, 'weather_cache': weather_cache.stats(),
+                        'upstream_in_flight': flights.in_flight(), 'upstream_shared': flights.shared,
+                        'upstream_breaker': client.breaker.stats()})
@@ -0,0 +1,94 @@
+import os
+import threading
+import time
+from flask import Response, g, request
+from prometheus_client import (CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram,
+                               REGISTRY, generate_latest, multiprocess)
+from .api.client import client
+from .api.breaker import STATES
+from .api.cache import weather_cache
+
+#Set by gunicorn_config.py so every worker writes its samples to files the scraped worker can sum
+MULTIPROC_DIR = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+
+REQUEST_LATENCY = Histogram('weather_http_request_duration_seconds', 'Request latency by route',
+                            ['endpoint', 'method', 'status'])
+UPSTREAM_LATENCY = Histogram('weather_upstream_duration_seconds', 'OpenWeatherMap call latency')
+UPSTREAM_ERRORS = Counter('weather_upstream_errors_total', 'OpenWeatherMap calls that failed or returned 5xx')
+CACHE_LOOKUPS = Counter('weather_cache_lookups_total', 'Worker weather cache lookups', ['result'])
+CACHE_EVICTIONS = Counter('weather_cache_evictions_total', 'Worker weather cache LRU evictions')
+#1 for the state each worker's OpenWeatherMap breaker is in, 0 for the others
+BREAKER_STATE = Gauge('weather_upstream_breaker_state', 'OpenWeatherMap circuit breaker state', ['state'],
+                      multiprocess_mode='livesum')
+BREAKER_REJECTED = Counter('weather_upstream_rejected_total', 'OpenWeatherMap calls failed fast by the open breaker')
+DB_POOL = Gauge('weather_db_pool_connections', 'Database pool connections by state', ['state'],
+                multiprocess_mode='livesum')
+
+_synced = {'hits': 0, 'stale_hits': 0, 'misses': 0, 'evictions': 0, 'rejected': 0}
+_sync_lock = threading.Lock()
+
+def _record_upstream(elapsed, status):
+    UPSTREAM_LATENCY.observe(elapsed)
+    if status is None or status >= 500:
+        UPSTREAM_ERRORS.inc()
+
+#The cache keeps plain counters, carry whatever changed since the last request into Prometheus
+def _sync_cache_counters():
+    stats = weather_cache.stats()
+    with _sync_lock:
+        for name, label in (('hits', 'hit'), ('stale_hits', 'stale'), ('misses', 'miss')):
+            delta = stats[name] - _synced[name]
+            if delta > 0:
+                CACHE_LOOKUPS.labels(label).inc(delta)
+            _synced[name] = stats[name]
+        if stats['evictions'] > _synced['evictions']:
+            CACHE_EVICTIONS.inc(stats['evictions'] - _synced['evictions'])
+        _synced['evictions'] = stats['evictions']
+
+def _record_breaker_state(state):
+    for name in STATES:
+        BREAKER_STATE.labels(name).set(1 if name == state else 0)
+
+def _sync_breaker_counters():
+    rejected = client.breaker.rejected
+    with _sync_lock:
+        if rejected > _synced['rejected']:
+            BREAKER_REJECTED.inc(rejected - _synced['rejected'])
+        _synced['rejected'] = rejected
+
+def _sync_pool_gauges(engine):
+    pool = engine.pool
+    if hasattr(pool, 'checkedout'):
+        DB_POOL.labels('checked_out').set(pool.checkedout())
+        DB_POOL.labels('idle').set(pool.checkedin())
+        DB_POOL.labels('overflow').set(max(pool.overflow(), 0))
+
+#Publishes this process's starting breaker state, gunicorn calls it in every worker once it has loaded the app
+def init_worker():
+    _record_breaker_state(client.breaker.state)
+
+def init_app(app, db):
+    client.observers.append(_record_upstream)
+    client.breaker.observers.append(_record_breaker_state)
+    #Under gunicorn this may run in the master, which must not publish a breaker state of its own
+    if not MULTIPROC_DIR:
+        init_worker()
+
+    @app.after_request
+    def observe_request(response):
+        started = g.get('perf_started')
+        if started is not None:
+            REQUEST_LATENCY.labels(request.endpoint or 'unknown', request.method, response.status_code).observe(time.perf_counter() - started)
+        _sync_cache_counters()
+        _sync_breaker_counters()
+        _sync_pool_gauges(db.get_engine(app))
+        return response
+
+    @app.route('/metrics')
+    def metrics():
+        if MULTIPROC_DIR:
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        else:
+            registry = REGISTRY
+        return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
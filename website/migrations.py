@@ -0,0 +1,178 @@
+import fcntl
+import os
+from contextlib import contextmanager
+import click
+from sqlalchemy import inspect, text
+from .config import SQLITE_PRAGMAS
+
+#Held while migrating so gunicorn workers starting together don't race each other
+LOCK_PATH = os.environ.get('MIGRATION_LOCK', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrate.lock'))
+
+#SQLite can't ALTER a column or constraint, so like Alembic's batch mode we build a copy of the
+#table with the new definition, copy the rows across and swap it in, all in one transaction
+def batch_rebuild_table(conn, table, create_sql, indexes=(), columns=None):
+    columns = columns or [column['name'] for column in inspect(conn).get_columns(table)]
+    conn.execute(text('DROP TABLE IF EXISTS _%s_new' % table))
+    conn.execute(text(create_sql.replace('CREATE TABLE %s ' % table, 'CREATE TABLE _%s_new ' % table, 1)))
+    column_list = ', '.join(columns)
+    conn.execute(text('INSERT INTO _%s_new (%s) SELECT %s FROM %s' % (table, column_list, column_list, table)))
+    conn.execute(text('DROP TABLE %s' % table))
+    conn.execute(text('ALTER TABLE _%s_new RENAME TO %s' % (table, table)))
+    for index in indexes:
+        conn.execute(text(index))
+
+#ADD COLUMN has no IF NOT EXISTS on SQLite, so check first and a rerun skips it
+def add_column(conn, table, column, definition):
+    if column not in [existing['name'] for existing in inspect(conn).get_columns(table.strip('"'))]:
+        conn.execute(text('ALTER TABLE %s ADD COLUMN %s %s' % (table, column, definition)))
+
+def add_city_indexes(conn):
+    #The unique index can't be built while a user has the same city twice, keep the oldest row
+    conn.execute(text('DELETE FROM city WHERE id NOT IN (SELECT MIN(id) FROM city GROUP BY user_id, name)'))
+    conn.execute(text('CREATE UNIQUE INDEX IF NOT EXISTS ix_city_user_id_name ON city (user_id, name)'))
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_city_weather_user_id_name ON city_weather (user_id, name)'))
+
+def bound_city_name_columns(conn):
+    if conn.dialect.name != 'sqlite':
+        conn.execute(text('ALTER TABLE city ALTER COLUMN name TYPE VARCHAR(200)'))
+        conn.execute(text('ALTER TABLE city_weather ALTER COLUMN name TYPE VARCHAR(200)'))
+        return
+    batch_rebuild_table(conn, 'city', 'CREATE TABLE city ('
+                        'id INTEGER NOT NULL, name VARCHAR(200), user_id INTEGER, '
+                        'PRIMARY KEY (id), FOREIGN KEY(user_id) REFERENCES user (id))',
+                        ['CREATE UNIQUE INDEX ix_city_user_id_name ON city (user_id, name)'])
+    batch_rebuild_table(conn, 'city_weather', 'CREATE TABLE city_weather ('
+                        'id INTEGER NOT NULL, name VARCHAR(200), temp_k INTEGER, '
+                        'temp_f NUMERIC(10, 2), temp_c NUMERIC(10, 2), temp_min NUMERIC(10, 2), '
+                        'temp_max NUMERIC(10, 2), description VARCHAR(150), '
+                        'wind_speed NUMERIC(10, 2), wind_dir INTEGER, user_id INTEGER, '
+                        'PRIMARY KEY (id), FOREIGN KEY(user_id) REFERENCES user (id))',
+                        ['CREATE INDEX ix_city_weather_user_id_name ON city_weather (user_id, name)'])
+
+#One city_weather row per normalized city instead of one per user, and users point at the
+#row they last checked. Duplicate rows collapse into the newest one for each city
+def share_city_weather(conn):
+    from .api.cache import normalize_city
+    add_column(conn, 'city_weather', 'city_key', 'VARCHAR(200)')
+    add_column(conn, 'city_weather', 'updated_at', 'INTEGER')
+    newest = {}
+    user_key = {}
+    for row_id, name, user_id in conn.execute(text('SELECT id, name, user_id FROM city_weather ORDER BY id')):
+        key = normalize_city(name or '')
+        newest[key] = row_id
+        if user_id is not None:
+            user_key[user_id] = key
+    keep = set(newest.values())
+    for row_id, in conn.execute(text('SELECT id FROM city_weather')).fetchall():
+        if row_id not in keep:
+            conn.execute(text('DELETE FROM city_weather WHERE id = :id'), {'id': row_id})
+    #updated_at stays NULL, we don't know how old these readings are
+    for key, row_id in newest.items():
+        conn.execute(text('UPDATE city_weather SET city_key = :key WHERE id = :id'), {'key': key, 'id': row_id})
+    if conn.dialect.name == 'sqlite':
+        batch_rebuild_table(conn, 'city_weather', 'CREATE TABLE city_weather ('
+                            'id INTEGER NOT NULL, city_key VARCHAR(200) NOT NULL, name VARCHAR(200), temp_k INTEGER, '
+                            'temp_f NUMERIC(10, 2), temp_c NUMERIC(10, 2), temp_min NUMERIC(10, 2), '
+                            'temp_max NUMERIC(10, 2), description VARCHAR(150), '
+                            'wind_speed NUMERIC(10, 2), wind_dir INTEGER, updated_at INTEGER, '
+                            'PRIMARY KEY (id))',
+                            ['CREATE UNIQUE INDEX ix_city_weather_city_key ON city_weather (city_key)'],
+                            columns=['id', 'city_key', 'name', 'temp_k', 'temp_f', 'temp_c', 'temp_min',
+                                     'temp_max', 'description', 'wind_speed', 'wind_dir', 'updated_at'])
+    else:
+        conn.execute(text('DROP INDEX IF EXISTS ix_city_weather_user_id_name'))
+        conn.execute(text('ALTER TABLE city_weather DROP COLUMN IF EXISTS user_id'))
+        conn.execute(text('ALTER TABLE city_weather ALTER COLUMN city_key SET NOT NULL'))
+        conn.execute(text('CREATE UNIQUE INDEX IF NOT EXISTS ix_city_weather_city_key ON city_weather (city_key)'))
+    add_column(conn, '"user"', 'weather_id', 'INTEGER REFERENCES city_weather (id)')
+    for user_id, key in user_key.items():
+        conn.execute(text('UPDATE "user" SET weather_id = :weather_id WHERE id = :user_id'),
+                     {'weather_id': newest[key], 'user_id': user_id})
+
+#Append new migrations at the end, never renumber or edit ones that have shipped
+MIGRATIONS = [
+    (1, 'add_city_indexes', add_city_indexes),
+    (2, 'bound_city_name_columns', bound_city_name_columns),
+    (3, 'share_city_weather', share_city_weather),
+]
+
+def current_version(conn):
+    conn.execute(text('CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL, name VARCHAR(100) NOT NULL)'))
+    return conn.execute(text('SELECT COALESCE(MAX(version), 0) FROM schema_version')).scalar()
+
+def record(conn, version, name):
+    conn.execute(text('INSERT INTO schema_version (version, name) VALUES (:version, :name)'), {'version': version, 'name': name})
+
+#One migration as one transaction. pysqlite only opens a transaction before INSERT/UPDATE/DELETE, so CREATE
+#and ALTER would each commit on their own, hence the explicit BEGIN. SQLite's recipe for schema changes also
+#turns foreign keys off, otherwise dropping a table that other rows reference fails, and checks them before committing
+@contextmanager
+def ddl_transaction(engine):
+    with engine.connect() as conn:
+        sqlite = conn.dialect.name == 'sqlite'
+        if sqlite:
+            conn.exec_driver_sql('PRAGMA foreign_keys=OFF')
+        try:
+            with conn.begin():
+                if sqlite:
+                    conn.exec_driver_sql('BEGIN')
+                yield conn
+                if sqlite:
+                    broken = conn.exec_driver_sql('PRAGMA foreign_key_check').fetchall()
+                    if broken:
+                        raise RuntimeError('migration left rows with broken foreign keys: %r' % broken[:10])
+        finally:
+            if sqlite:
+                conn.exec_driver_sql('PRAGMA foreign_keys=%s' % SQLITE_PRAGMAS['foreign_keys'])
+
+#Arbitrary key for pg_advisory_lock, shared by every app server pointed at the same database
+ADVISORY_LOCK_KEY = 72310412
+
+#Creates a new database at the latest version, or applies whatever migrations an existing one is missing
+def upgrade(app, db):
+    engine = db.get_engine(app)
+    with open(LOCK_PATH, 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if engine.dialect.name != 'postgresql':
+            return _upgrade(app, db, engine)
+        #The lock file only covers one host, Postgres may be shared by several
+        with engine.connect() as lock_conn:
+            lock_conn.execute(text('SELECT pg_advisory_lock(:key)'), {'key': ADVISORY_LOCK_KEY})
+            try:
+                return _upgrade(app, db, engine)
+            finally:
+                lock_conn.execute(text('SELECT pg_advisory_unlock(:key)'), {'key': ADVISORY_LOCK_KEY})
+
+def _upgrade(app, db, engine):
+    applied = []
+    if not inspect(engine).has_table('user'):
+        with ddl_transaction(engine) as conn:
+            db.metadata.create_all(bind=conn)
+            current_version(conn)
+            for version, name, _ in MIGRATIONS:
+                record(conn, version, name)
+        print("created database")
+        return applied
+    for version, name, migrate in MIGRATIONS:
+        with ddl_transaction(engine) as conn:
+            if version <= current_version(conn):
+                continue
+            migrate(conn)
+            record(conn, version, name)
+        applied.append(name)
+        print("applied migration %d %s" % (version, name))
+    #Tables added to the models without a migration of their own
+    db.create_all(app=app)
+    return applied
+
+@click.command('db-upgrade')
+def db_upgrade_command():
+    from flask import current_app
+    from . import db
+    applied = upgrade(current_app, db)
+    click.echo('applied %d migration(s)' % len(applied))
+
+#python -m website.migrations (or flask db-upgrade) upgrades the database in place
+if __name__ == '__main__':
+    from . import create_app
+    create_app()
@@ -2,9 +2,14 @@ from . import db
 from flask_login import UserMixin
 from sqlalchemy.sql import func
 
+#Longest OpenWeatherMap city names are well under this, with room for a ", CC" suffix
+CITY_NAME_LENGTH = 200
+
 class City(db.Model):
+    #One row per city per user, and lookups by (user_id, name) hit this index instead of scanning
+    __table_args__ = (db.Index('ix_city_user_id_name', 'user_id', 'name', unique=True),)
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(10000))
+    name = db.Column(db.String(CITY_NAME_LENGTH))
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
 
 class User(db.Model, UserMixin):
@@ -12,12 +17,18 @@ class User(db.Model, UserMixin):
     email = db.Column(db.String(150), unique=True)
     password = db.Column(db.String(150))
     first_name = db.Column(db.String(150))
-    cities = db.relationship('City')
+    #The city weather this user last checked, shared with everyone else checking that city
+    weather_id = db.Column(db.Integer, db.ForeignKey('city_weather.id'))
+    cities = db.relationship('City', lazy='select', order_by='City.id')
     weather = db.relationship('CityWeather')
 
+#Latest conditions for one city, stored once no matter how many users look at it
 class CityWeather(db.Model):
+    __table_args__ = (db.Index('ix_city_weather_city_key', 'city_key', unique=True),)
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(10000))
+    #normalize_city(name), so "London" and "london " share a row
+    city_key = db.Column(db.String(CITY_NAME_LENGTH), nullable=False)
+    name = db.Column(db.String(CITY_NAME_LENGTH))
     temp_k = db.Column(db.Integer)
     temp_f = db.Column(db.Numeric(precision=10, scale=2))
     temp_c = db.Column(db.Numeric(precision=10, scale=2))
@@ -26,4 +37,18 @@ class CityWeather(db.Model):
     description = db.Column(db.String(150))
     wind_speed = db.Column(db.Numeric(precision=10, scale=2))
     wind_dir = db.Column(db.Integer)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    updated_at = db.Column(db.Integer)
+
+#Append-only history shared by all users, one row per upstream reading of a city.
+#The primary key clusters each city's rows in time order, so a history query is one index range scan.
+#Values are stored as integers in hundredths (kelvin, m/s) instead of Numeric
+class Observation(db.Model):
+    owm_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    observed_at = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    temp_k = db.Column(db.Integer)
+    temp_min = db.Column(db.Integer)
+    temp_max = db.Column(db.Integer)
+    wind_speed = db.Column(db.Integer)
+    wind_dir = db.Column(db.SmallInteger)
+    description = db.Column(db.String(150))
+    __table_args__ = (db.Index('ix_observation_observed_at', 'observed_at'),)
@@ -0,0 +1,91 @@
+import fcntl
+import logging
+import os
+import threading
+import time
+from . import db, history
+from .models import City
+from .api import weatherAPI as wAPI
+from .api.cache import normalize_city
+
+#Refresh a bit faster than the cache TTL so tracked cities never go cold
+PREWARM_INTERVAL = float(os.environ.get('WEATHER_PREWARM_INTERVAL', 480))
+#The free OpenWeatherMap plan allows 60 calls a minute, leave headroom for user traffic
+PREWARM_RATE = int(os.environ.get('WEATHER_PREWARM_RATE', 40))
+#Calls allowed back to back before the rate limit kicks in
+PREWARM_BATCH = int(os.environ.get('WEATHER_PREWARM_BATCH', 10))
+PREWARM_LOCK = os.environ.get('WEATHER_PREWARM_LOCK', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'prewarm.lock'))
+
+log = logging.getLogger(__name__)
+
+#Distinct tracked cities, deduplicated the same way the caches key them
+def tracked_cities(app):
+    with app.app_context():
+        names = [row[0] for row in db.session.query(City.name).distinct() if row[0]]
+    cities = {}
+    for name in names:
+        cities.setdefault(normalize_city(name), name)
+    return list(cities.values())
+
+#Token bucket: up to burst calls back to back, then one every 60 / rate seconds
+class RateLimiter:
+    def __init__(self, rate, burst):
+        self.interval = 60.0 / rate
+        self.burst = max(min(burst, rate), 1)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+
+    def wait(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) / self.interval)
+        self.updated = now
+        if self.tokens < 1:
+            time.sleep((1 - self.tokens) * self.interval)
+            self.tokens = 1
+            self.updated = time.monotonic()
+        self.tokens -= 1
+
+#Fetch every tracked city, group calls and single-city fallbacks alike counted against
+#PREWARM_RATE calls a minute. Cities without a known ID cost one call each on their first pass
+def prewarm_once(app, rate=PREWARM_RATE, batch_size=PREWARM_BATCH):
+    cities = tracked_cities(app)
+    limiter = RateLimiter(rate, batch_size)
+    refreshed = sum(snapshot is not None for snapshot in wAPI.fetch_group(cities, limiter.wait))
+    log.info('prewarmed %d of %d tracked cities', refreshed, len(cities))
+    return refreshed
+
+def run(app, interval=PREWARM_INTERVAL):
+    while True:
+        started = time.monotonic()
+        try:
+            prewarm_once(app)
+        except Exception:
+            log.exception('weather prewarm failed')
+        try:
+            with app.app_context():
+                history.compact()
+        except Exception:
+            log.exception('history compaction failed')
+        time.sleep(max(0, interval - (time.monotonic() - started)))
+
+#Every worker calls this, but only the one holding the lock file runs the loop
+def _run_when_leader(app, interval):
+    with open(PREWARM_LOCK, 'w') as lock:
+        while True:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except OSError:
+                time.sleep(interval)
+        run(app, interval)
+
+def start(app, interval=PREWARM_INTERVAL):
+    thread = threading.Thread(target=_run_when_leader, args=(app, interval), name='weather-prewarm', daemon=True)
+    thread.start()
+    return thread
+
+#python -m website.prewarm runs the scheduler as its own process instead
+if __name__ == '__main__':
+    from . import create_app
+    logging.basicConfig(level=logging.INFO)
+    run(create_app())
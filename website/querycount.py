@@ -0,0 +1,33 @@
+from contextlib import contextmanager
+from sqlalchemy import event
+
+#Counts the SQL statements an engine runs inside the block:
+#    with count_queries(db.engine) as queries:
+#        client.get('/')
+#    assert queries.count <= 4, queries.statements
+class QueryCounter:
+    def __init__(self):
+        self.statements = []
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+@contextmanager
+def count_queries(engine):
+    counter = QueryCounter()
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        counter.statements.append(statement)
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield counter
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+#Fails with the statements listed when the block runs more than limit queries
+@contextmanager
+def assert_max_queries(engine, limit):
+    with count_queries(engine) as counter:
+        yield counter
+    if counter.count > limit:
+        raise AssertionError('expected at most %d queries, ran %d:\n%s' % (limit, counter.count, '\n'.join(counter.statements)))
@@ -14,4 +14,23 @@ function checkWeather(cityId){
     }).then((_res) => {
         window.location.href="/weather";   
     });
-}
\ No newline at end of file
+}
+
+let suggestTimer = null;
+function suggestCities(prefix){
+    clearTimeout(suggestTimer);
+    if (prefix.trim().length < 2) return;
+    suggestTimer = setTimeout(() => {
+        fetch('/autocomplete?q=' + encodeURIComponent(prefix))
+        .then((res) => res.json())
+        .then((cities) => {
+            const list = document.getElementById('city_suggestions');
+            list.innerHTML = '';
+            cities.forEach((city) => {
+                const option = document.createElement('option');
+                option.value = city.label;
+                list.appendChild(option);
+            });
+        });
+    }, 150);
+}
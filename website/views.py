@@ -1,29 +1,53 @@
 from flask import Blueprint, render_template, flash, request, jsonify, redirect, url_for
 from flask_login import login_required, current_user
-from .models import City, CityWeather
+from .models import City, CityWeather, CITY_NAME_LENGTH
 from . import db
 import json 
 from .api import weatherAPI as wAPI
+from .api import async_fetch
+from .api.cache import normalize_city
+from .api.breaker import CLOSED
+from .api.gazetteer import get_gazetteer
+from .api.shared_cache import shared_cache
+from . import history
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+import time
 
 views = Blueprint('views', __name__)
 
+AUTOCOMPLETE_LIMIT = 25
+#How often each worker recounts which cities our users track
+POPULARITY_TTL = 300
+_popularity = {'ranked': [], 'loaded_at': None}
+
 @views.route('/', methods=['GET', 'POST'])
 @login_required
 def home():
     if request.method == 'POST':
-        city = request.form.get('city')
-        cityExists = City.query.filter_by(name=city).first()
+        city = (request.form.get('city') or '').strip()
+        cityExists = City.query.filter_by(user_id=current_user.id, name=city).first()
         if cityExists:
             flash('You already have ' +city + ' listed', category = "error")
-        elif not wAPI.check_if_city_exists(city):
-            flash('City does not exist', category="eror")
         elif len(city) <= 1:
             flash('Please type in city name', category = "error")
+        elif len(city) > CITY_NAME_LENGTH:
+            flash('City name is too long', category = "error")
         else:
-            new_city = City(name=city, user_id=current_user.id)
-            db.session.add(new_city)
-            db.session.commit()
-            flash('City added!', category='success')
+            try:
+                exists = wAPI.check_if_city_exists(city)
+            except wAPI.UPSTREAM_ERRORS:
+                exists = None
+            if exists is None:
+                flash('Could not check ' + city + ' right now, please try again in a minute', category="error")
+            elif not exists:
+                flash('City does not exist', category="error")
+            else:
+                new_city = City(name=city, user_id=current_user.id)
+                db.session.add(new_city)
+                db.session.commit()
+                flash('City added!', category='success')
     return render_template("home.html", user=current_user)
 
 @views.route('/delete-note', methods=['POST'])
@@ -37,22 +61,117 @@ def delete_note():
             db.session.commit()
     return jsonify({})
 
+#Everyone checking this city shares one row, refreshing it is a single update.
+#Two users checking a new city at once must not both insert it, so the insert skips an existing key
+def city_weather_row(key):
+    weather = CityWeather.query.filter_by(city_key=key).first()
+    if weather is None:
+        insert = postgresql_insert if db.engine.dialect.name == 'postgresql' else sqlite_insert
+        db.session.execute(insert(CityWeather.__table__).values(city_key=key)
+                           .on_conflict_do_nothing(index_elements=['city_key']))
+        weather = CityWeather.query.filter_by(city_key=key).one()
+    return weather
+
 @views.route('/weather', methods=['GET','POST'])
+@login_required
 def weather():
     if request.method == 'POST':
-        weather = CityWeather.query.filter_by(user_id = current_user.id).first()
-        if weather:
-            print("Weather deleted")
-            db.session.delete(weather)
-            db.session.commit()
         city = json.loads(request.data)
         cityId = city['cityId']
-        city_name = City.query.get(cityId).name
-        temps = wAPI.getTemps(city_name)
-        description = wAPI.getDescription(city_name)
-        wind = wAPI.getWind(city_name)
-        new_weather = CityWeather(name=city_name, temp_c=temps[0][0], temp_f=temps[0][1], temp_k=int(temps[0][2]), temp_max=temps[1], temp_min=temps[2], description=description, wind_speed=wind[0], wind_dir=int(wind[1]), user_id = current_user.id)
-        db.session.add(new_weather)
+        city = City.query.get(cityId)
+        if city is None or city.user_id != current_user.id:
+            return jsonify({}), 404
+        #A recent enough copy is shown at once and refreshed in the background
+        try:
+            snapshot, age = wAPI.lookup_snapshot(city.name)
+        except wAPI.UPSTREAM_ERRORS:
+            flash('Weather for ' + city.name + ' is unavailable right now, please try again later', category="error")
+            return jsonify({}), 503
+        updated_at = int(time.time() - age)
+        key = normalize_city(city.name)
+        weather = city_weather_row(key)
+        #Another user may already have stored a newer reading
+        if weather.updated_at is None or weather.updated_at <= updated_at:
+            temps = snapshot.temps
+            weather.name = city.name
+            weather.temp_c = temps[0]
+            weather.temp_f = temps[1]
+            weather.temp_k = int(temps[2])
+            weather.temp_max = snapshot.temp_max
+            weather.temp_min = snapshot.temp_min
+            weather.description = snapshot.description
+            weather.wind_speed = snapshot.wind_speed
+            weather.wind_dir = int(snapshot.wind_dir)
+            weather.updated_at = updated_at
+        current_user.weather = weather
         db.session.commit()
 
-    return render_template("weather.html", user=current_user)
\ No newline at end of file
+    #Rows carried over from before updated_at existed are of unknown age, and just as stale
+    stale, stale_minutes = False, None
+    weather = current_user.weather
+    if weather is not None:
+        if weather.updated_at is None:
+            stale = True
+        elif time.time() - weather.updated_at >= wAPI.weather_cache.ttl:
+            stale, stale_minutes = True, int((time.time() - weather.updated_at) // 60)
+    upstream_down = wAPI.client.breaker.state != CLOSED
+    return render_template("weather.html", user=current_user, stale=stale, stale_minutes=stale_minutes, upstream_down=upstream_down)
+
+@views.route('/dashboard')
+@login_required
+def dashboard():
+    cities = current_user.cities
+    rows = []
+    #Readings past the TTL are fallbacks from an outage, marked like the weather page marks them
+    for city, (snapshot, age) in zip(cities, async_fetch.fetch_snapshots([city.name for city in cities])):
+        stale_minutes = int(age // 60) if snapshot is not None and age >= wAPI.weather_cache.ttl else None
+        rows.append((city, snapshot, stale_minutes))
+    upstream_down = wAPI.client.breaker.state != CLOSED
+    return render_template("dashboard.html", user=current_user, rows=rows,
+                           stale=any(row[2] is not None for row in rows), upstream_down=upstream_down)
+
+#Keys of the cities our users track, most tracked first, recounted every POPULARITY_TTL seconds
+def city_popularity():
+    now = time.monotonic()
+    if _popularity['loaded_at'] is None or now - _popularity['loaded_at'] > POPULARITY_TTL:
+        counts = {}
+        for name, count in db.session.query(City.name, func.count(City.id)).group_by(City.name):
+            key = normalize_city(name or '')
+            counts[key] = counts.get(key, 0) + count
+        _popularity['ranked'] = sorted(counts, key=lambda key: -counts[key])
+        _popularity['loaded_at'] = now
+    return _popularity['ranked']
+
+@views.route('/autocomplete')
+@login_required
+def autocomplete():
+    prefix = request.args.get('q', '')
+    limit = min(max(request.args.get('limit', 10, type=int), 1), AUTOCOMPLETE_LIMIT)
+    popular = city_popularity()
+    matches = get_gazetteer().complete(prefix, limit, popular)
+    if not matches:
+        #Without a bundled city list, suggest what other users already track
+        key = normalize_city(prefix)
+        tracked = [k for k in popular if key and k.startswith(key)][:limit]
+        matches = [{'name': k.title(), 'country': '', 'label': k.title()} for k in tracked]
+    return jsonify(matches)
+
+#Past readings for one of the user's cities, read from the local observation history
+@views.route('/history/<int:cityId>')
+@login_required
+def city_history(cityId):
+    city = City.query.get(cityId)
+    if city is None or city.user_id != current_user.id:
+        return jsonify({'error': 'city not found'}), 404
+    key = normalize_city(city.name)
+    owm_id = shared_cache.city_ids([key]).get(key)
+    if owm_id is None:
+        return jsonify([])
+    since = request.args.get('since', type=int)
+    return jsonify([{'observed_at': o.observed_at,
+                     'temp_k': o.temp_k / 100,
+                     'temp_min': o.temp_min / 100 if o.temp_min is not None else None,
+                     'temp_max': o.temp_max / 100 if o.temp_max is not None else None,
+                     'wind_speed': o.wind_speed / 100 if o.wind_speed is not None else None,
+                     'wind_dir': o.wind_dir,
+                     'description': o.description} for o in history.history(owm_id, since)])
\ No newline at end of file